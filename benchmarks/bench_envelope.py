@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Compare the envelope generator with the previous Faker based envelope.
+
+Usage::
+
+    $ python benchmarks/bench_envelope.py --profiles 200
+"""
+import argparse
+import random
+import timeit
+
+from faker import Faker
+
+from iam_profile_faker.envelope import EnvelopeGenerator
+from iam_profile_faker.factory import DISPLAY, C_GROUP, IAMFaker
+
+# Number of values wrapped with metadata/signature in an average profile
+ENVELOPES_PER_PROFILE = 40
+
+
+class FakerEnvelope(object):
+    """Envelope generation as previously done in IAMFaker, through Faker providers."""
+
+    def __init__(self):
+        self.fake = Faker()
+
+    def metadata(self, display, c12n):
+        created = self.fake.date_time()
+        last_modified = self.fake.date_time_between_dates(datetime_start=created)
+
+        return {
+            'classification': c12n,
+            'display': random.choice(display),
+            'last_modified': last_modified.isoformat(),
+            'created': created.isoformat(),
+            'verified': self.fake.pybool(),
+        }
+
+    def signature(self):
+        def _gen_signature():
+            return {
+                'alg': 'RS256',
+                'typ': 'JWS',
+                'value': '{}.{}.{}'.format(self.fake.pystr(), self.fake.pystr(),
+                                           self.fake.pystr()),
+                'name': random.choice(['access_provider', 'ldap', 'hris', 'cis', 'mozilliansorg'])
+            }
+
+        return {
+            'publisher': _gen_signature(),
+            'additional': [_gen_signature() for i in range(random.randint(0, 5))]
+        }
+
+
+def time_envelope(generator, number):
+    """Return the mean time in seconds to generate one envelope."""
+    def run():
+        generator.metadata(DISPLAY, C_GROUP)
+        generator.signature()
+    return min(timeit.repeat(run, number=number, repeat=3)) / number
+
+
+def time_profile(number):
+    """Return the mean time in seconds to generate one full profile."""
+    faker = IAMFaker()
+    return min(timeit.repeat(faker.create, number=number, repeat=3)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--profiles', type=int, default=200,
+                        help='Number of profiles worth of envelopes to time.')
+    args = parser.parse_args()
+
+    number = args.profiles * ENVELOPES_PER_PROFILE
+    before = time_envelope(FakerEnvelope(), number)
+    after = time_envelope(EnvelopeGenerator(), number)
+    profile = time_profile(args.profiles)
+
+    print('envelope (faker):     {0:8.1f} us'.format(before * 1e6))
+    print('envelope (generator): {0:8.1f} us'.format(after * 1e6))
+    print('speedup:              {0:8.1f}x'.format(before / after))
+    print('saved per profile:    {0:8.2f} ms'.format(
+        (before - after) * ENVELOPES_PER_PROFILE * 1e3))
+    print('profile (current):    {0:8.2f} ms'.format(profile * 1e3))
+
+
+if __name__ == '__main__':
+    main()
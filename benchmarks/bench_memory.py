@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Measure the memory held by a batch of profiles as dicts and in compact form.
+
+Every representation is measured in a fresh process: the bytes per profile
+are the memory allocated by the batch and still held once it is built, as
+traced by `tracemalloc`, the peak RSS includes the interpreter and the
+generation itself::
+
+    $ python benchmarks/bench_memory.py --count 2000
+"""
+import argparse
+import gc
+import json
+import multiprocessing
+import resource
+import sys
+import timeit
+import tracemalloc
+
+from iam_profile_faker.compact import to_compact
+from iam_profile_faker.factory import V2ProfileFactory
+
+
+def _generated(factory, count, seed):
+    return factory.create_batch(count, seed=seed)
+
+
+def _generated_compact(factory, count, seed):
+    return factory.create_batch(count, seed=seed, compact=True)
+
+
+def _loaded(factory, count, seed):
+    # Like the profiles of a store loaded from a JSON file
+    return [json.loads(profile) for profile in
+            factory.iter_encoded(count, seed=seed)]
+
+
+def _loaded_compact(factory, count, seed):
+    return [to_compact(json.loads(profile)) for profile in
+            factory.iter_encoded(count, seed=seed)]
+
+
+# Name, function building a batch from (factory, count, seed)
+REPRESENTATIONS = [
+    ('dicts', _generated),
+    ('compact', _generated_compact),
+    ('dicts (from JSON)', _loaded),
+    ('compact (from JSON)', _loaded_compact),
+]
+
+
+def _peak_rss_bytes():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _measure(build, count, seed, queue):
+    factory = V2ProfileFactory()
+    # Load the vocabulary and the serializer outside of the traced allocations
+    build(factory, 1, seed)
+
+    gc.collect()
+    tracemalloc.start()
+    start = timeit.default_timer()
+    batch = build(factory, count, seed)
+    elapsed = timeit.default_timer() - start
+    gc.collect()
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    queue.put({
+        'bytes_per_profile': held / count,
+        'seconds': elapsed,
+        'peak_rss_bytes': _peak_rss_bytes(),
+        'count': len(batch),
+    })
+
+
+def measure(build, count, seed):
+    """Return the memory held by a batch built by `build`, measured in a child process."""
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_measure, args=(build, count, seed, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=2000, help='Number of profiles.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the generated profiles.')
+    args = parser.parse_args()
+
+    print('{0:<20} {1:>16} {2:>14} {3:>12}'.format(
+        'representation', 'bytes/profile', 'peak RSS MB', 'seconds'))
+    results = {}
+    for name, build in REPRESENTATIONS:
+        result = results[name] = measure(build, args.count, args.seed)
+        print('{0:<20} {1:>16,.0f} {2:>14.1f} {3:>12.2f}'.format(
+            name, result['bytes_per_profile'], result['peak_rss_bytes'] / 1e6,
+            result['seconds']))
+    for source in ('', ' (from JSON)'):
+        print('compact{0}: {1:.1f}x less memory'.format(
+            source, results['dicts' + source]['bytes_per_profile'] /
+            results['compact' + source]['bytes_per_profile']))
+
+
+if __name__ == '__main__':
+    main()
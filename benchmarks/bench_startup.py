@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Measure package import time and cold vs warm single profile latency.
+
+Import time and cold latency are measured in fresh interpreters, with and
+without the vocabulary disk cache, warm latency in this process, both with a
+shared factory and with a new factory per profile::
+
+    $ python benchmarks/bench_startup.py --runs 10 --profiles 200
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import timeit
+
+from iam_profile_faker.factory import V2ProfileFactory
+
+# Run in a fresh interpreter, prints the import time and the time to the
+# first profile, in seconds
+COLD_SCRIPT = '''
+import json, timeit
+start = timeit.default_timer()
+import iam_profile_faker
+imported = timeit.default_timer()
+iam_profile_faker.V2ProfileFactory().create(export_json=True)
+created = timeit.default_timer()
+print(json.dumps([imported - start, created - imported]))
+'''
+
+
+def cold(runs, cache_dir):
+    """Return the import times and first profile latencies of `runs` fresh interpreters.
+
+    An empty `cache_dir` disables the vocabulary disk cache.
+    """
+    env = dict(os.environ, IAM_PROFILE_FAKER_CACHE_DIR=cache_dir)
+    imports, firsts = [], []
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, '-c', COLD_SCRIPT], env=env)
+        imported, created = json.loads(output.decode('utf-8'))
+        imports.append(imported)
+        firsts.append(created)
+    return imports, firsts
+
+
+def warm(number):
+    """Return the mean latency of a profile with a shared and with a new factory."""
+    factory = V2ProfileFactory()
+    factory.create(export_json=True)
+    shared = min(timeit.repeat(lambda: factory.create(export_json=True),
+                               number=number, repeat=3)) / number
+    fresh = min(timeit.repeat(lambda: V2ProfileFactory().create(export_json=True),
+                              number=number, repeat=3)) / number
+    return shared, fresh
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10,
+                        help='Number of fresh interpreters to time.')
+    parser.add_argument('--profiles', type=int, default=200,
+                        help='Number of profiles per repetition when timing warm latency.')
+    args = parser.parse_args()
+
+    imports, uncached = cold(args.runs, '')
+    cache_dir = tempfile.mkdtemp()
+    try:
+        cold(1, cache_dir)
+        _, cached = cold(args.runs, cache_dir)
+    finally:
+        shutil.rmtree(cache_dir)
+    shared, fresh = warm(args.profiles)
+
+    def line(name, values):
+        print('{0:<34} {1:8.1f} ms (median), {2:8.1f} ms (min)'.format(
+            name, statistics.median(values) * 1e3, min(values) * 1e3))
+
+    line('import iam_profile_faker', imports)
+    line('first profile (cold, no cache)', uncached)
+    line('first profile (cold, disk cache)', cached)
+    print('{0:<34} {1:8.2f} ms'.format('profile (warm, shared factory)', shared * 1e3))
+    print('{0:<34} {1:8.2f} ms'.format('profile (warm, new factory)', fresh * 1e3))
+
+
+if __name__ == '__main__':
+    main()
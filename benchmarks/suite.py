@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Benchmark profile generation throughput, field generator cost and memory.
+
+Every batch size runs in a fresh process so that its peak RSS is not
+affected by the previous ones. Batches are streamed, one profile at a time,
+so sizes of millions of profiles run in constant memory. Results are written as JSON and can be
+compared with the results of another commit::
+
+    $ python benchmarks/suite.py --sizes 1,100,10000 --output before.json
+    $ git checkout other-branch
+    $ python benchmarks/suite.py --sizes 1,100,10000 --compare before.json
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import timeit
+
+import faker
+
+import iam_profile_faker
+from iam_profile_faker.factory import ENGINES, IAMFaker, V2ProfileFactory
+from iam_profile_faker.serializers import get_serializer
+
+DEFAULT_SIZES = '1,10,100,1000'
+
+# IAMFaker generator methods timed on their own, with their arguments
+FIELDS = [
+    ('login_method', lambda f: f.login_method()),
+    ('user_id', lambda f: f.user_id()),
+    ('usernames', lambda f: f.usernames()),
+    ('identities', lambda f: f.identities()),
+    ('ssh_public_keys', lambda f: f.ssh_public_keys()),
+    ('pgp_public_keys', lambda f: f.pgp_public_keys()),
+    ('access_information', lambda f: f.access_information()),
+    ('hris', lambda f: f.hris()),
+    ('staff_information', lambda f: f.staff_information(f.hris())),
+    ('languages', lambda f: f.languages()),
+    ('pronouns', lambda f: f.pronouns()),
+    ('uris', lambda f: f.uris()),
+    ('phone_numbers', lambda f: f.phone_numbers()),
+    ('metadata', lambda f: f.metadata()),
+    ('signature', lambda f: f.signature()),
+    ('create', lambda f: f.create()),
+]
+
+
+def _peak_rss_bytes():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _run_batch(size, seed, engine, queue):
+    factory = V2ProfileFactory()
+    dumps_bytes = factory.serializer.dumps_bytes
+    timer = timeit.default_timer
+    generation = serialization = 0.0
+
+    # Profiles are streamed to a null sink and dropped once serialized, so the
+    # peak RSS does not grow with the size of the batch
+    profiles = factory.iter_batch(size, seed=seed, engine=engine)
+    with open(os.devnull, 'wb') as sink:
+        while True:
+            start = timer()
+            obj = next(profiles, None)
+            generated = timer()
+            if obj is None:
+                break
+            sink.write(dumps_bytes(obj))
+            serialization += timer() - generated
+            generation += generated - start
+
+    queue.put({
+        'size': size,
+        'generation_seconds': generation,
+        'profiles_per_second': size / generation,
+        'serialization_seconds': serialization,
+        'serialized_per_second': size / serialization,
+        'peak_rss_bytes': _peak_rss_bytes(),
+    })
+
+
+def bench_batch(size, seed, engine='default'):
+    """Generate and serialize a stream of `size` profiles in a child process."""
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_run_batch, args=(size, seed, engine, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def bench_fields(seed, number):
+    """Return the mean cost in microseconds of every IAMFaker generator."""
+    results = {}
+    for name, call in FIELDS:
+        faker_ = IAMFaker(seed=seed)
+        timings = timeit.repeat(lambda: call(faker_), number=number, repeat=3)
+        results[name] = min(timings) / number * 1e6
+    return results
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       stderr=subprocess.STDOUT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, seed, field_number, engine='default'):
+    return {
+        'meta': {
+            'timestamp': datetime.datetime.utcnow().isoformat(),
+            'revision': _git_revision(),
+            'version': iam_profile_faker.__version__,
+            'python': platform.python_version(),
+            'faker': faker.VERSION,
+            'serializer': get_serializer().name,
+            'seed': seed,
+            'engine': engine,
+        },
+        'batches': [bench_batch(size, seed, engine) for size in sizes],
+        'fields_us': bench_fields(seed, field_number),
+    }
+
+
+def compare(results, baseline):
+    """Print the change of every metric relative to `baseline`."""
+    def line(name, value, before):
+        change = (value - before) / before * 100 if before else float('nan')
+        print('{0:<40} {1:>14.2f} {2:>14.2f} {3:>+8.1f}%'.format(name, before, value, change))
+
+    print('{0:<40} {1:>14} {2:>14} {3:>9}'.format('metric', 'baseline', 'current', 'change'))
+    previous = dict((batch['size'], batch) for batch in baseline['batches'])
+    for batch in results['batches']:
+        if batch['size'] not in previous:
+            continue
+        for key in ('profiles_per_second', 'serialized_per_second', 'peak_rss_bytes'):
+            line('batch {0} {1}'.format(batch['size'], key), batch[key],
+                 previous[batch['size']][key])
+    for name, value in sorted(results['fields_us'].items()):
+        if name in baseline['fields_us']:
+            line('field {0} (us)'.format(name), value, baseline['fields_us'][name])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default=DEFAULT_SIZES,
+                        help='Comma separated batch sizes, up to 1000000.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the generated profiles.')
+    parser.add_argument('--field-number', type=int, default=200,
+                        help='Calls per repetition when timing field generators.')
+    parser.add_argument('--engine', default='default', choices=ENGINES,
+                        help='Engine used to generate the batches.')
+    parser.add_argument('--output', help='File to write the JSON results to.')
+    parser.add_argument('--compare', help='JSON results of a previous run to compare with.')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    results = run(sizes, args.seed, args.field_number, args.engine)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+    elif not args.output:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+
+"""asyncio flavour of the API, serving the routes of `v2_api` with aiohttp.
+
+Profile generation is CPU bound, so it never runs on the event loop: it is
+handed to a pool of worker processes and the loop only awaits the results,
+while it keeps serving the lookups of the persistent store. The number of
+generation requests in flight is bounded, beyond it requests are turned away
+with a 503 instead of queueing up. Large batches are generated and sent a
+chunk at a time, with at most two chunks of a response in the pool, so
+neither the response nor the queue grow with the batch size.
+
+Requires the `async` extra::
+
+    $ pip install iam_profile_faker[async]
+    $ iam_profile_faker_async_api --port 5000 --workers 4
+"""
+import asyncio
+import collections
+import json
+import os
+import random
+
+from concurrent.futures import ProcessPoolExecutor
+
+import click
+from aiohttp import web
+
+from iam_profile_faker.factory import V2ProfileFactory
+from iam_profile_faker.store import (
+    CachedStore, int_argument, locate_store, page_arguments, page_profiles)
+
+# Number of profiles of a /users response generated in one go by a worker
+CHUNK_SIZE = 500
+
+# Profiles of /persistent/users gathered in one write
+WRITE_SIZE = 100
+
+# Largest batch a client can request from /users
+MAX_COUNT = int(os.environ.get('FAKER_MAX_COUNT', 10000))
+
+# Used in the worker processes
+_factory = V2ProfileFactory()
+
+
+def _generate(count, start=0, seed=None):
+    """Return `count` profiles from position `start` as the items of a JSON array."""
+    return b', '.join(_factory.iter_encoded(count, seed=seed, start=start))
+
+
+class Saturated(Exception):
+    """Raised when the generation pool already serves as many requests as it accepts."""
+
+
+class GenerationPool(object):
+    """Process pool generating the profiles of the requests of the event loop.
+
+    At most `max_pending` requests are served at the same time, `acquire`
+    raises `Saturated` beyond. The pool is only used from the event loop
+    thread, so the counters need no lock.
+    """
+
+    def __init__(self, workers=None, max_pending=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * 4
+        self.pending = 0
+        self.rejected = 0
+        self.executor = None
+
+    async def start(self, app):
+        self.executor = ProcessPoolExecutor(self.workers)
+
+    async def shutdown(self, app):
+        self.executor.shutdown(wait=False)
+
+    def acquire(self):
+        """Reserve a slot for a request, raise `Saturated` if there is none left."""
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise Saturated()
+        self.pending += 1
+
+    def release(self):
+        self.pending -= 1
+
+    def submit(self, count, start=0, seed=None):
+        """Return a future of `_generate(count, start, seed)` run in a worker process."""
+        return asyncio.get_running_loop().run_in_executor(
+            self.executor, _generate, count, start, seed)
+
+
+def _error(error, message, **kwargs):
+    """Return the HTTP exception `error` with a flask_restful like JSON body."""
+    return error(text=json.dumps({'message': message}), content_type='application/json',
+                 **kwargs)
+
+
+class AsyncStore(object):
+    """Serve the `CachedStore` `cached` to the event loop.
+
+    Loading a store reads the whole file, so reloads run in the default
+    thread pool executor instead of on the event loop, and the requests
+    arriving meanwhile wait for the same reload.
+    """
+
+    def __init__(self, cached):
+        self.cached = cached
+        self._reloading = None
+
+    def _reloaded(self, future):
+        self._reloading = None
+
+    def reload(self):
+        """Return a future of the store, reloaded in a thread."""
+        if self._reloading is None:
+            self._reloading = asyncio.get_running_loop().run_in_executor(
+                None, self.cached.reload)
+            self._reloading.add_done_callback(self._reloaded)
+        # A cancelled request does not cancel the reload of the others
+        return asyncio.shield(self._reloading)
+
+    async def get(self):
+        """Return the cached store, reloading it if the file changed."""
+        if self._reloading is not None or self.cached.stale():
+            return await self.reload()
+        return self.cached.store
+
+
+def _int_argument(request, name, minimum):
+    """Return query string argument `name` as an int, None if it is missing."""
+    try:
+        return int_argument(request.query, name, minimum)
+    except ValueError as error:
+        raise _error(web.HTTPBadRequest, str(error))
+
+
+def _acquire(pool):
+    try:
+        pool.acquire()
+    except Saturated:
+        raise _error(web.HTTPServiceUnavailable,
+                     'Too many profiles are being generated, retry later.',
+                     headers={'Retry-After': '1'})
+
+
+async def _stream(request, chunks, headers=None):
+    """Send the byte strings of the async iterator `chunks` as a JSON response.
+
+    Every write waits for the client to keep up with the response.
+    """
+    response = web.StreamResponse(headers=headers)
+    response.content_type = 'application/json'
+    await response.prepare(request)
+    async for chunk in chunks:
+        await response.write(chunk)
+    await response.write_eof()
+    return response
+
+
+async def random_users(request):
+    """Return `count` random users, 100 by default, reproducible with `seed`.
+
+    The profiles are generated `CHUNK_SIZE` at a time, the next chunk while
+    the previous one is sent.
+    """
+    count = _int_argument(request, 'count', 1) or 100
+    if count > MAX_COUNT:
+        raise _error(web.HTTPBadRequest, 'count must be <= {0}'.format(MAX_COUNT))
+    seed = _int_argument(request, 'seed', 0)
+    if seed is None:
+        # Shared by the chunks so that they make a single batch
+        seed = random.getrandbits(64)
+
+    pool = request.app['generation_pool']
+    _acquire(pool)
+    starts = iter(range(0, count, CHUNK_SIZE))
+    pending = collections.deque()
+
+    def submit():
+        for start in starts:
+            pending.append(pool.submit(min(CHUNK_SIZE, count - start), start, seed))
+            return
+
+    async def chunks():
+        separator = b'['
+        while pending:
+            profiles = await pending.popleft()
+            submit()
+            yield separator + profiles
+            separator = b', '
+        yield b']\n'
+
+    try:
+        submit()
+        submit()
+        return await _stream(request, chunks())
+    finally:
+        for future in pending:
+            future.cancel()
+        pool.release()
+
+
+async def random_user(request):
+    """Return a single random user."""
+    pool = request.app['generation_pool']
+    _acquire(pool)
+    try:
+        body = await pool.submit(1, seed=random.getrandbits(64))
+    finally:
+        pool.release()
+    return web.Response(body=body, content_type='application/json')
+
+
+async def persistent_users(request):
+    """Return the users from the db, see `v2_api.PersistentUsers`.
+
+    Pages are read from the in-memory store, which is fast enough to be done
+    on the event loop, and sent `WRITE_SIZE` users at a time. The store is
+    reloaded off the loop, see `AsyncStore`.
+    """
+    try:
+        cursor, limit, fields = page_arguments(request.query)
+    except ValueError as error:
+        raise _error(web.HTTPBadRequest, str(error))
+
+    store = await request.app['persistent_store'].get()
+    items, next_cursor = page_profiles(store, cursor, limit, fields)
+    headers = {'X-Next-Cursor': str(next_cursor)} if next_cursor is not None else {}
+
+    async def chunks():
+        batch = ['[']
+        separator = ''
+        for item in items:
+            batch.append(separator)
+            batch.append(item)
+            separator = ', '
+            if len(batch) >= 2 * WRITE_SIZE:
+                yield ''.join(batch).encode('utf-8')
+                batch = []
+        batch.append(']\n')
+        yield ''.join(batch).encode('utf-8')
+
+    return await _stream(request, chunks(), headers=headers)
+
+
+async def persistent_user(request):
+    """Return a single user with id `user_id`."""
+    store = await request.app['persistent_store'].get()
+    profile = store.get(request.match_info['user_id'])
+    return web.json_response(profile)
+
+
+def create_app(workers=None, max_pending=None, store=None):
+    """Return the aiohttp application.
+
+    `workers` is the number of generation processes, `max_pending` the
+    number of generation requests served at the same time. The persistent
+    `CachedStore` `store` defaults to the one of `v2_api`, located in the
+    package directory.
+    """
+    app = web.Application()
+    pool = GenerationPool(workers, max_pending)
+    app['generation_pool'] = pool
+    app['persistent_store'] = AsyncStore(store or CachedStore(
+        lambda: locate_store(os.path.dirname(os.path.abspath(__file__))),
+        check_interval=float(os.environ.get('FAKER_DB_CHECK_INTERVAL', 5))))
+    app.on_startup.append(pool.start)
+    app.on_cleanup.append(pool.shutdown)
+    app.router.add_get('/', random_users)
+    app.router.add_get('/users', random_users)
+    app.router.add_get('/user', random_user)
+    app.router.add_get('/persistent/users', persistent_users)
+    app.router.add_get('/persistent/user/{user_id}', persistent_user)
+    return app
+
+
+@click.command()
+@click.option('--host', default='0.0.0.0', help='Address to listen on.')
+@click.option('--port', type=int, default=5000, help='Port to listen on.')
+@click.option('--workers', type=int, default=None,
+              help='Number of generation processes, defaults to the available cores.')
+@click.option('--max-pending', type=int, default=None,
+              help='Number of generation requests served at the same time before '
+                   'answering 503, defaults to 4 per worker.')
+def main(host, port, workers, max_pending):
+    """Serve the API with aiohttp, generating profiles in a process pool."""
+    web.run_app(create_app(workers, max_pending), host=host, port=port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,442 @@
+# -*- coding: utf-8 -*-
+
+"""Bulk engine generating profiles a block at a time.
+
+`IAMFaker` makes dozens of Faker provider calls per profile and each one pays
+for provider lookup, locale dispatch and weighted sampling. This engine
+instead draws the random primitives of a whole block of profiles at once:
+
+* the values of the Faker providers used by the profiles (names, jobs,
+  companies, sentences, URIs...) are picked from the vocabulary pools, see
+  `iam_profile_faker.vocabulary`,
+* random strings, md5 hashes and signature values are cut from large buffers
+  of random bytes drawn with a single `getrandbits` call,
+* numbers, list lengths and choices come straight from `random.Random`.
+
+The profiles have exactly the same shape as the ones of `IAMFaker.create`.
+With a seed, every block of `BLOCK_SIZE` profiles is derived from the seed and
+the position of the block, so batches are reproducible and can be generated
+in parallel or in several parts, but a single profile cannot be regenerated
+on its own.
+"""
+import base64
+import datetime
+import itertools
+import random
+import string
+import time
+
+from iam_profile_faker.envelope import EPOCH, SIGNATURE_PART_LENGTH, SIGNATURE_PUBLISHERS
+from iam_profile_faker.factory import (ACCESS_PUBLISHERS, C_GROUP, C_NDAED, C_PUBLIC,
+                                       C_STAFF, DISPLAY, EXTERNAL_ACCOUNTS, IDENTITIES,
+                                       LOGIN_METHODS, MANAGEMENT_LEVELS, OFFICE_LOCATIONS,
+                                       PRONOUNS, SEED_REFERENCE_TIME, WORKER_TYPES,
+                                       derive_seed, iter_hierarchy)
+from iam_profile_faker.vocabulary import get_vocabulary
+
+# Number of profiles sharing the same random buffers, `SHARD_SIZE` has to be a
+# multiple of it for parallel batches to match single process ones
+BLOCK_SIZE = 250
+
+# Faker providers picked from the vocabulary pools
+VOCABULARY = [
+    'first_name', 'last_name', 'name', 'job', 'company', 'color_name', 'timezone', 'city',
+    'state', 'country', 'country_code', 'language_code', 'slug', 'uri', 'phone_number',
+    'paragraph', 'sentence', 'word', 'free_email_domain', 'domain_name',
+]
+
+SCHEMA = 'https://person-api.sso.mozilla.com/schema/v2/profile'
+
+# staff_information fields: name, HRIS field holding the value (always True
+# when None), display levels and classification
+STAFF_INFORMATION = [
+    ('manager', 'IsManager', ['ndaed'], C_NDAED),
+    ('director', 'isDirectorOrAbove', ['ndaed'], C_NDAED),
+    ('staff', None, ['ndaed'], C_NDAED),
+    ('title', 'businessTitle', ['ndaed'], C_NDAED),
+    ('team', 'Team', ['ndaed'], C_NDAED),
+    ('cost_center', 'Cost_Center', ['staff'], C_STAFF),
+    ('worker_type', 'WorkerType', ['staff'], C_STAFF),
+    ('wpr_desk_number', 'WPRDeskNumber', ['ndaed'], C_NDAED),
+    ('office_location', 'Location_Description', ['ndaed'], C_NDAED),
+]
+
+# Formats of the generated user names, after Faker's internet provider
+USER_NAME_FORMATS = [
+    '{last}.{first}', '{first}.{last}', '{first}{number}', '{initial}{last}',
+]
+
+# Chunk sizes, in characters, of the random string buffers and in items of the
+# pre-built signatures and timestamps
+_CHUNK = 1 << 16
+_ITEMS = 4096
+
+# Maps every byte to an ASCII letter, for Faker `pystr` like strings
+_LETTERS = (string.ascii_letters * 5)[:256].encode('ascii')
+
+
+class _Buffer(object):
+    """Hand out slices of random strings produced `_CHUNK` characters at a time."""
+
+    def __init__(self, fill):
+        self.fill = fill
+        self.data = ''
+        self.position = 0
+
+    def take(self, length):
+        """Return the next `length` characters."""
+        end = self.position + length
+        if end > len(self.data):
+            self.data = self.data[self.position:] + self.fill(max(_CHUNK, length))
+            self.position, end = 0, length
+        value = self.data[self.position:end]
+        self.position = end
+        return value
+
+
+class _Items(object):
+    """Hand out items of lists produced `_ITEMS` items at a time."""
+
+    def __init__(self, fill):
+        self.fill = fill
+        self.items = []
+
+    def take(self, count):
+        """Return a list of the next `count` items."""
+        items = self.items
+        if len(items) < count:
+            items = self.items = self.fill(max(_ITEMS, count)) + items
+        taken = items[-count:]
+        del items[-count:]
+        return taken
+
+    def pop(self):
+        """Return the next item."""
+        try:
+            return self.items.pop()
+        except IndexError:
+            self.items = self.fill(_ITEMS)
+            return self.items.pop()
+
+
+class BulkFaker(object):
+    """Generate profile v2 objects one block of profiles at a time."""
+
+    def __init__(self, locale=None, seed=None, now=None, hierarchy=None):
+        if seed is not None and now is None:
+            now = SEED_REFERENCE_TIME
+        self.seed = seed
+        self.now = now
+        self.hierarchy = hierarchy
+        vocabulary = get_vocabulary(locale)
+        self.vocabulary = dict((name, vocabulary.pool(name)) for name in VOCABULARY)
+        self.random = random.Random(seed)
+
+        def random_bytes(count):
+            return self.random.getrandbits(count * 8).to_bytes(count, 'little')
+
+        self.letters = _Buffer(
+            lambda count: random_bytes(count).translate(_LETTERS).decode('ascii'))
+        self.hexdigits = _Buffer(lambda count: random_bytes(count // 2).hex())
+        self.signatures = _Items(self._signatures)
+        self.timestamps = _Items(self._timestamps)
+
+    def _signature_pairs(self, count):
+        # (value, name) pairs of signatures
+        length = SIGNATURE_PART_LENGTH
+        size = length * 3 * 3 // 4
+        raw = self.random.getrandbits(count * size * 8).to_bytes(count * size, 'little')
+        encoded = base64.urlsafe_b64encode(raw).decode('ascii')
+        values = [encoded[i:i + length] + '.' + encoded[i + length:i + 2 * length] + '.' +
+                  encoded[i + 2 * length:i + 3 * length]
+                  for i in range(0, count * length * 3, length * 3)]
+        return list(zip(values, self.random.choices(SIGNATURE_PUBLISHERS, k=count)))
+
+    def _signatures(self, count):
+        return [{'alg': 'RS256', 'typ': 'JWS', 'value': value, 'name': name}
+                for value, name in self._signature_pairs(count)]
+
+    def _timestamps(self, count):
+        # (created, last_modified) ISO 8601 pairs of the metadata blocks
+        rand = self.random.random
+        end = self._now_seconds() * 1000000
+        created = [int(rand() * end) for _ in range(count)]
+        last_modified = [value + int(rand() * (end - value)) for value in created]
+        delta = datetime.timedelta
+        return [((EPOCH + delta(microseconds=first)).isoformat(),
+                 (EPOCH + delta(microseconds=last)).isoformat())
+                for first, last in zip(created, last_modified)]
+
+    def _reseed(self, block):
+        # Buffers are dropped so that a block only depends on its own seed
+        self.random.seed(derive_seed(self.seed, block, 'bulk'))
+        for buffer in (self.letters, self.hexdigits):
+            buffer.data, buffer.position = '', 0
+        for items in (self.signatures, self.timestamps):
+            items.items = []
+
+    def _now_seconds(self):
+        if self.now is None:
+            return int(time.time())
+        return int((self.now - EPOCH).total_seconds())
+
+    def iter_profiles(self, count, start=0):
+        """Yield `count` profiles, the first one being at position `start` of the batch.
+
+        With a seed `start` has to be a multiple of `BLOCK_SIZE`.
+        """
+        return self._iter(self.create, count, start)
+
+    def _iter(self, create, count, start):
+        for block_start in range(start, start + count, BLOCK_SIZE):
+            if self.seed is not None:
+                self._reseed(block_start // BLOCK_SIZE)
+            for _ in range(min(BLOCK_SIZE, start + count - block_start)):
+                yield create()
+
+    def pick(self, name):
+        """Return a value of the Faker provider `name` from the vocabulary pools."""
+        values = self.vocabulary[name]
+        return values[int(self.random.random() * len(values))]
+
+    def randint(self, a, b):
+        """Return a random integer N such that a <= N <= b."""
+        return a + int(self.random.random() * (b - a + 1))
+
+    def pybool(self):
+        return self.random.random() < 0.5
+
+    def pyint(self):
+        return self.randint(0, 9999)
+
+    def pystr(self, min_chars, max_chars):
+        """Return a string of random ASCII letters, like Faker's `pystr`."""
+        return self.letters.take(self.randint(min_chars, max_chars))
+
+    def md5(self):
+        """Return 32 random hexadecimal digits."""
+        return self.hexdigits.take(32)
+
+    def user_name(self):
+        pick = self.pick
+        first, last = pick('first_name'), pick('last_name')
+        return USER_NAME_FORMATS[int(self.random.random() * len(USER_NAME_FORMATS))].format(
+            first=first, last=last, initial=first[:1], number=self.randint(0, 99)).lower()
+
+    def email(self):
+        domain = self.pick('free_email_domain' if self.random.random() < 0.5 else 'domain_name')
+        return '{}@{}'.format(self.user_name(), domain)
+
+    def envelope(self, display):
+        """Draw the random parts of a metadata/signature envelope.
+
+        Return the index of the display level among `display`, the created
+        and last modified timestamps, the verified flag and the signatures.
+        """
+        rand = self.random.random
+        created, last_modified = self.timestamps.pop()
+        signatures = self.signatures.take(1 + int(rand() * 6))
+        return int(rand() * len(display)), created, last_modified, rand() < 0.5, signatures
+
+    def wrap(self, value, display=DISPLAY, c12n=C_GROUP):
+        """Wrap `value` with random metadata and signatures."""
+        index, created, last_modified, verified, signatures = self.envelope(display)
+        return {
+            'values' if isinstance(value, (dict, list)) else 'value': value,
+            'metadata': {
+                'classification': c12n,
+                'display': display[index],
+                'last_modified': last_modified,
+                'created': created,
+                'verified': verified,
+            },
+            'signature': {
+                'publisher': signatures[0],
+                'additional': signatures[1:],
+            },
+        }
+
+    def values(self):
+        """Draw the values of the next profile, keyed by their dotted path in the profile."""
+        rng = self.random
+        rand = rng.random
+        pick, randint, pybool, pyint, pystr = (self.pick, self.randint, self.pybool, self.pyint,
+                                               self.pystr)
+        user_name, email = self.user_name, self.email
+
+        method = LOGIN_METHODS[int(rand() * len(LOGIN_METHODS))]
+        if method == 'email':
+            uid = 'email|{}'.format(pystr(24, 24))
+        elif method == 'github':
+            uid = 'github|{}'.format(pyint())
+        elif method == 'google-oauth2':
+            uid = 'google-oauth2|{}'.format(pyint())
+        elif method == 'ad|Mozilla-LDAP':
+            uid = 'ad|Mozilla-LDAP|{}'.format(user_name())
+        else:
+            uid = 'oauth2|firefoxaccounts|{}'.format(pystr(32, 32))
+
+        end = self._now_seconds()
+        created = int(rand() * end)
+        last_modified = created + int(rand() * (end - created))
+        values = {
+            'login_method': method,
+            'user_id': uid,
+            'created': (EPOCH + datetime.timedelta(seconds=created)).isoformat(),
+            'last_modified': (EPOCH + datetime.timedelta(seconds=last_modified)).isoformat(),
+        }
+
+        for publisher, _ in ACCESS_PUBLISHERS:
+            access = {}
+            for _ in range(randint(1, 5)):
+                access[pick('slug')] = None if publisher == 'mozilliansorg' else pybool()
+            values['access_information.' + publisher] = access
+
+        employee_id, manager_id = (next(self.hierarchy) if self.hierarchy
+                                   else (pyint(), pyint()))
+        level = MANAGEMENT_LEVELS[int(rand() * len(MANAGEMENT_LEVELS))]
+        hris = values['access_information.hris'] = {
+            'LastName': pick('last_name'),
+            'Preferred_Name': pick('name'),
+            'PreferredFirstName': pick('first_name'),
+            'LegalFirstName': pick('first_name'),
+            'EmployeeID': employee_id,
+            'businessTitle': pick('job'),
+            'IsManager': pybool(),
+            'isDirectorOrAbove': pybool(),
+            'Management_Level': '{} Manager'.format(level) if pybool() else '',
+            'HireDate': (EPOCH + datetime.timedelta(days=int(rand() * (end // 86400)))).strftime(
+                '%Y-%m-%d'),
+            'CurrentlyActive': '1' if pybool() else '0',
+            'Entity': pick('company'),
+            'Team': '{} team'.format(pick('color_name')),
+            'Cost_Center': '{} - {}'.format(pyint(), pick('job')),
+            'WorkerType': WORKER_TYPES[int(rand() * len(WORKER_TYPES))],
+            'Location_Description': OFFICE_LOCATIONS[int(rand() * len(OFFICE_LOCATIONS))],
+            'Time_Zone': pick('timezone'),
+            'LocationCity': pick('city'),
+            'LocationState': pick('state'),
+            'LocationCountryFull': pick('country'),
+            'LocationCountryISO2': pick('country_code'),
+            'WorkersManager': 'unknown',
+            'WorkersManagersEmployeeID': manager_id,
+            'Worker_s_Manager_s_Email_Address': email(),
+            'primary_work_email': email(),
+            'WPRDeskNumber': str(pyint()),
+            'EgenciaPOSCountry': pick('country_code'),
+            'PublicEmailAddresses': [email() for _ in range(randint(0, 5))],
+        }
+        org = getattr(self.hierarchy, 'org', None)
+        if org is not None:
+            org.update_hris(hris)
+        for name, field, _, _ in STAFF_INFORMATION:
+            values['staff_information.' + name] = hris[field] if field else True
+        for name, _ in IDENTITIES:
+            values['identities.' + name] = self.md5()
+
+        uris = {}
+        for name in rng.sample(EXTERNAL_ACCOUNTS, randint(0, 4)):
+            uris[name] = pick('uri')
+        for _ in range(randint(0, 4)):
+            uris[pick('slug')] = pick('uri')
+
+        values.update({
+            'active': pybool(),
+            'alternative_name': pick('name'),
+            'description': pick('paragraph'),
+            'first_name': pick('first_name'),
+            'fun_title': pick('sentence'),
+            'languages': [pick('language_code') for _ in range(randint(0, 5))],
+            'last_name': pick('last_name'),
+            'location': pick('country'),
+            'pgp_public_keys': dict(
+                (pick('slug'), '-----BEGIN PGP PUBLIC KEY BLOCK-----\n\n{}'
+                               '\n-----END PGP PUBLIC KEY BLOCK-----\n'.format(pystr(250, 500)))
+                for _ in range(randint(0, 5))),
+            'phone_numbers': dict((pick('slug'), pick('phone_number'))
+                                  for _ in range(randint(0, 5))),
+            'picture': None,
+            'primary_email': email(),
+            'pronouns': PRONOUNS[int(rand() * len(PRONOUNS))],
+            'ssh_public_keys': dict(
+                (pick('slug'), 'ssh-rsa {} {}'.format(pystr(250, 500), email()))
+                for _ in range(randint(0, 5))),
+            'tags': [pick('word') for _ in range(3)],
+            'timezone': pick('timezone'),
+            'uris': uris,
+            'usernames': dict([('mozilliansorg', user_name())] + [
+                (pick('slug'), user_name()) for _ in range(randint(0, 5))]),
+        })
+        if org is not None:
+            # The profile of the employee the HRIS records of the reports refer to
+            person = org.person(hris['EmployeeID'])
+            values.update({
+                'first_name': person.first_name,
+                'last_name': person.last_name,
+                'primary_email': person.email,
+            })
+        return values
+
+    def create(self):
+        """Generate the next profile v2 object of the block."""
+        values = self.values()
+        wrap = self.wrap
+
+        user_id = wrap(values['user_id'], c12n=C_PUBLIC)
+        user_id['metadata']['display'] = 'public'
+
+        access_information = {}
+        for publisher, c12n in ACCESS_PUBLISHERS:
+            access_information[publisher] = wrap(values['access_information.' + publisher],
+                                                 display=[None], c12n=c12n)
+        access_information['hris'] = wrap(values['access_information.hris'], display=[None],
+                                          c12n=C_STAFF)
+
+        return {
+            'access_information': access_information,
+            'active': wrap(values['active'], display=[None]),
+            'alternative_name': wrap(values['alternative_name']),
+            'created': wrap(values['created'], c12n=C_PUBLIC),
+            'description': wrap(values['description']),
+            'first_name': wrap(values['first_name'], c12n=C_PUBLIC),
+            'fun_title': wrap(values['fun_title']),
+            'identities': dict((name, wrap(values['identities.' + name], display=display))
+                               for name, display in IDENTITIES),
+            'languages': wrap(values['languages']),
+            'last_modified': wrap(values['last_modified'], c12n=C_PUBLIC),
+            'last_name': wrap(values['last_name'], c12n=C_PUBLIC),
+            'location': wrap(values['location']),
+            'login_method': wrap(values['login_method'], c12n=C_PUBLIC),
+            'pgp_public_keys': wrap(values['pgp_public_keys'], c12n=C_PUBLIC),
+            'phone_numbers': wrap(values['phone_numbers']),
+            'picture': wrap(None, c12n=C_PUBLIC),
+            'primary_email': wrap(values['primary_email'], c12n=C_PUBLIC),
+            'pronouns': wrap(values['pronouns']),
+            'schema': SCHEMA,
+            'ssh_public_keys': wrap(values['ssh_public_keys'], c12n=C_PUBLIC),
+            'staff_information': dict(
+                (name, wrap(values['staff_information.' + name], display=display, c12n=c12n))
+                for name, _, display, c12n in STAFF_INFORMATION),
+            'tags': wrap(values['tags']),
+            'timezone': wrap(values['timezone']),
+            'uris': wrap(values['uris']),
+            'user_id': user_id,
+            'usernames': wrap(values['usernames'], display=['public']),
+        }
+
+
+def block_offset(start, seed=None):
+    """Return the number of profiles to skip to generate a batch from position `start`.
+
+    Seeded blocks are generated from their first profile, so that any part of
+    a batch matches the whole batch.
+    """
+    return start % BLOCK_SIZE if seed is not None else 0
+
+
+def iter_bulk_profiles(count, start=0, seed=None, locale=None, org=None):
+    """Yield `count` profiles generated by the bulk engine, see `BulkFaker`."""
+    skip = block_offset(start, seed)
+    faker = BulkFaker(locale=locale, seed=seed,
+                      hierarchy=iter_hierarchy(start - skip, count + skip, seed, org))
+    return itertools.islice(faker.iter_profiles(count + skip, start=start - skip), skip, None)
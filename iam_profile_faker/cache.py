@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+"""Size bounded LRU cache for serialized responses."""
+import collections
+import threading
+
+
+class LRUCache(object):
+    """Thread safe LRU cache of byte strings bounded by their total size.
+
+    Values larger than `max_bytes` are not cached.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.items = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Return the value cached for `key` or None."""
+        with self.lock:
+            try:
+                entry = self.items.pop(key)
+            except KeyError:
+                return None
+            self.items[key] = entry
+            return entry[0]
+
+    def set(self, key, value, size=None):
+        """Cache `value`, evicting the least recently used values to make room.
+
+        `size` defaults to `len(value)`.
+        """
+        size = len(value) if size is None else size
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            if key in self.items:
+                self.size -= self.items.pop(key)[1]
+            while self.items and self.size + size > self.max_bytes:
+                self.size -= self.items.popitem(last=False)[1][1]
+            self.items[key] = (value, size)
+            self.size += size
+
+    def __len__(self):
+        return len(self.items)
@@ -3,12 +3,59 @@
 """Console script for iam_profile_faker."""
 import os
 import sys
+import tempfile
+import time
 
 import click
 
-from tinydb import TinyDB
-
 from iam_profile_faker import V2ProfileFactory
+from iam_profile_faker.factory import ENGINES
+from iam_profile_faker.hierarchy import SPAN_OF_CONTROL, OrgHierarchy
+from iam_profile_faker.instrumentation import Instrumentation
+from iam_profile_faker.records import write_records
+from iam_profile_faker.store import CHUNK_SIZE, STORE_EXTENSIONS, insert_chunks, open_store
+from iam_profile_faker.writers import COMPRESSION_EXTENSIONS, open_output
+
+
+def compression_options(f):
+    """Add the --compress and --level options to a command."""
+    f = click.option('--level', type=int, default=None,
+                     help='Compression level, 1-9 for gzip and 1-22 for zstd.')(f)
+    f = click.option('--compress', type=click.Choice(sorted(COMPRESSION_EXTENSIONS)),
+                     default=None,
+                     help='Compress the output while writing it, zstd requires the '
+                          'zstandard package.')(f)
+    return f
+
+
+engine_option = click.option(
+    '--engine', type=click.Choice(ENGINES), default='default',
+    help='Generation engine, bulk is several times faster but its profiles cannot be '
+         'regenerated one by one with create --seed --index, template renders bulk '
+         'profiles from a precompiled JSON skeleton.')
+
+
+def org_options(f):
+    """Add the --org, --span and --max-depth options to a command."""
+    f = click.option('--max-depth', type=int, default=None,
+                     help='Maximum number of levels of the org tree under its top.')(f)
+    f = click.option('--span', type=(int, int, int), default=SPAN_OF_CONTROL,
+                     help='Minimum, most likely and maximum number of direct reports of '
+                          'a manager in the org tree.')(f)
+    f = click.option('--org', is_flag=True, default=False,
+                     help='Link the HRIS records of the profiles to their managers in a '
+                          'realistic org tree.')(f)
+    return f
+
+
+def create_org(org, count, seed, span, max_depth):
+    """Return the `OrgHierarchy` of the org options, None without --org."""
+    if not org:
+        return None
+    try:
+        return OrgHierarchy(count, seed=seed, span=span, max_depth=max_depth)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
 
 
 @click.group()
@@ -17,63 +64,194 @@ def main():
 
 
 @click.command()
-def create(*args, **kwargs):
+@click.option('--seed', type=int, default=None,
+              help='Seed to generate a reproducible set of profiles.')
+@click.option('--index', type=int, default=0,
+              help='Position of the profile in the batch generated with --seed.')
+def create(seed, index):
     """Create single IAM profile v2 object."""
 
     factory = V2ProfileFactory()
-    output = factory.create(export_json=True)
+    output = factory.create(export_json=True, seed=seed, index=index)
     click.echo(output)
 
 
 @click.command()
 @click.option('--count', type=int, help='Number of v2 profile objects to create')
-def create_batch(count):
+@click.option('--ndjson', is_flag=True, default=False,
+              help='Write one profile per line instead of a JSON array.')
+@click.option('--workers', type=int, default=1,
+              help='Number of worker processes used to generate the profiles.')
+@click.option('--seed', type=int, default=None,
+              help='Seed to generate a reproducible set of profiles.')
+@click.option('--instrument', is_flag=True, default=False,
+              help='Print the time spent in every generator to stderr.')
+@click.option('--output', default='-',
+              help='File to write the profiles to, stdout by default.')
+@compression_options
+@engine_option
+@org_options
+def create_batch(count, ndjson, workers, seed, instrument, output, compress, level, engine,
+                 org, span, max_depth):
     """Create batch IAM profile v2 objects."""
 
     if count < 1:
         raise click.BadParameter('count needs to be > 0')
 
-    factory = V2ProfileFactory()
-    output = factory.create_batch(count, export_json=True)
-    click.echo(output)
+    org = create_org(org, count, seed, span, max_depth)
+    instrumentation = Instrumentation() if instrument else None
+    factory = V2ProfileFactory(instrumentation=instrumentation)
+    with open_output(output, compress=compress, level=level) as f:
+        factory.write_batch(count, f, ndjson=ndjson, workers=workers, seed=seed,
+                            engine=engine, org=org)
+        if not ndjson:
+            f.write(b'\n')
+
+    if instrumentation:
+        click.echo(instrumentation.report(), err=True, nl=False)
 
 
 @click.command()
 @click.option('--count', type=int, default=100,
               help='Number of v2 profile objects to create in the db.')
 @click.argument('dbname', default='db')
-def populate_db(count, dbname):
-    """Create batch IAM profile v2 objects and insert them in the database."""
+@click.option('--backend', type=click.Choice(['sqlite', 'tinydb']), default='tinydb',
+              help='Database backend, sqlite stores are indexed by user_id, '
+                   'primary_email and EmployeeID. tinydb rewrites the whole file for '
+                   'every chunk, use sqlite for large databases.')
+@click.option('--workers', type=int, default=1,
+              help='Number of worker processes used to generate the profiles.')
+@click.option('--seed', type=int, default=None,
+              help='Seed to generate a reproducible set of profiles.')
+@click.option('--chunk-size', type=click.IntRange(1), default=CHUNK_SIZE,
+              help='Number of profiles generated and inserted at a time.')
+@click.option('--resume', is_flag=True, default=False,
+              help='Keep the profiles already in the database and only add the missing '
+                   'ones, with the same --seed the database ends up as if the run had '
+                   'never been interrupted.')
+@engine_option
+@org_options
+def populate_db(count, dbname, backend, workers, seed, chunk_size, resume, engine, org, span,
+                max_depth):
+    """Create batch IAM profile v2 objects and insert them in the database.
+
+    Profiles are generated and inserted a chunk at a time, so memory use does
+    not depend on COUNT with the sqlite backend.
+    """
 
     path = os.path.dirname(os.path.abspath(__file__))
 
-    if not dbname.endswith('.json'):
-        dbname = '{0}.json'.format(dbname)
+    extension = STORE_EXTENSIONS[backend]
+    if not dbname.endswith(extension):
+        dbname = '{0}{1}'.format(dbname, extension)
 
     click.echo('Creating database {0}'.format(dbname))
 
-    db = TinyDB(os.path.join(path, dbname))
-    users = V2ProfileFactory().create_batch(count, export_json=False)
-    db.insert_multiple(users)
+    org = create_org(org, count, seed, span, max_depth)
+    store = open_store(os.path.join(path, dbname))
+    start = len(store) if resume else 0
+    if start >= count:
+        click.echo('Database {0} already has {1} profiles.'.format(dbname, start))
+        return
+    if start:
+        click.echo('Resuming after {0} profiles.'.format(start))
+
+    factory = V2ProfileFactory()
+    users = factory.iter_batch(count - start, workers=workers, seed=seed, engine=engine,
+                               org=org, start=start)
+    started = time.time()
+    for inserted in insert_chunks(store, users, chunk_size=chunk_size):
+        elapsed = max(time.time() - started, 1e-6)
+        click.echo('Inserted {0}/{1} profiles ({2:.0f} profiles/s)'.format(
+            start + inserted, count, inserted / elapsed))
 
-    click.echo('Added {0} profiles in database {1}.'.format(count, dbname))
+    click.echo('Added {0} profiles in database {1}.'.format(count - start, dbname))
 
 
 @click.command()
 @click.option('--count', type=int, default=100,
               help='Number of v2 profile objects to create in the db.')
 @click.argument('filename', default='export')
-def export_json(count, filename):
-    """Create batch IAM profile v2 objects and insert them in the database."""
+@click.option('--ndjson', is_flag=True, default=False,
+              help='Write one profile per line instead of a JSON array.')
+@click.option('--workers', type=int, default=1,
+              help='Number of worker processes used to generate the profiles.')
+@click.option('--seed', type=int, default=None,
+              help='Seed to generate a reproducible set of profiles.')
+@click.option('--instrument', is_flag=True, default=False,
+              help='Print the time spent in every generator to stderr.')
+@click.option('--output', default=None,
+              help='Path to write the file to, - for stdout. Overrides FILENAME, which is '
+                   'created in the package directory.')
+@compression_options
+@engine_option
+@org_options
+def export_json(count, filename, ndjson, workers, seed, instrument, output, compress, level,
+                engine, org, span, max_depth):
+    """Create batch IAM profile v2 objects and export them to a JSON file."""
+
+    if output is None:
+        path = os.path.dirname(os.path.abspath(__file__))
+        extension = '.ndjson' if ndjson else '.json'
+        if compress:
+            extension += COMPRESSION_EXTENSIONS[compress]
+        if not filename.endswith(extension):
+            filename = '{0}{1}'.format(filename, extension)
+        output = os.path.join(path, filename)
+    else:
+        filename = output
+
+    org = create_org(org, count, seed, span, max_depth)
+    # Keep stdout clean when the profiles are written to it
+    err = output == '-'
+    click.echo('Creating file {0}'.format(filename), err=err)
+    instrumentation = Instrumentation() if instrument else None
+    factory = V2ProfileFactory(instrumentation=instrumentation)
+    with open_output(output, compress=compress, level=level) as f:
+        factory.write_batch(count, f, ndjson=ndjson, workers=workers, seed=seed,
+                            engine=engine, org=org)
+
+    click.echo('Added {0} profiles into file {1}.'.format(count, filename), err=err)
+    if instrumentation:
+        click.echo(instrumentation.report(), err=True, nl=False)
+
+
+@click.command()
+@click.option('--count', type=int, default=100,
+              help='Number of v2 profile objects to create in the file.')
+@click.argument('filename', default='export')
+@click.option('--level', type=click.IntRange(0, 9), default=6,
+              help='zlib compression level of the records.')
+@click.option('--workers', type=int, default=1,
+              help='Number of worker processes used to generate the profiles.')
+@click.option('--seed', type=int, default=None,
+              help='Seed to generate a reproducible set of profiles.')
+@engine_option
+@org_options
+def export_records(count, filename, level, workers, seed, engine, org, span, max_depth):
+    """Create batch IAM profile v2 objects and export them to an indexed record file."""
 
     path = os.path.dirname(os.path.abspath(__file__))
-    if not filename.endswith('.json'):
-        filename = '{0}.json'.format(filename)
+    extension = STORE_EXTENSIONS['records']
+    if not filename.endswith(extension):
+        filename = '{0}{1}'.format(filename, extension)
 
+    org = create_org(org, count, seed, span, max_depth)
     click.echo('Creating file {0}'.format(filename))
-    users = V2ProfileFactory().create_batch(count, export_json=True)
-    with open(os.path.join(path, filename), 'w') as f:
-        f.write(users)
+    factory = V2ProfileFactory()
+    # Written to a temporary file renamed over the target once complete, a
+    # running API may have the previous file memory mapped
+    fd, temporary = tempfile.mkstemp(dir=path, prefix='.{0}.'.format(filename), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            profiles = factory.iter_batch(count, workers=workers, seed=seed, engine=engine,
+                                          org=org)
+            write_records(profiles, f, level=level)
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, os.path.join(path, filename))
+    except BaseException:
+        os.remove(temporary)
+        raise
 
     click.echo('Added {0} profiles into file {1}.'.format(count, filename))
 
@@ -82,6 +260,7 @@ main.add_command(create)
 main.add_command(create_batch)
 main.add_command(populate_db)
 main.add_command(export_json)
+main.add_command(export_records)
 
 if __name__ == "__main__":
     sys.exit(main())  # pragma: no cover
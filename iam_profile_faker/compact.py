@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+
+"""Compact in-memory representation of profile v2 objects.
+
+A profile is made of ~200 small dicts: every one of its ~40 values is wrapped
+in an envelope with a metadata dict, a signature dict and a dict per
+signature publisher, and a dict has a large fixed overhead. Batches of
+profiles kept in memory, like the ones of `create_batch(compact=True)` or of
+the persistent store of the API, are held in this representation instead:
+
+* envelopes are `Envelope` objects with slots, their metadata and signature
+  are flattened in them and their publishers are `Publisher` objects
+* the objects of the profile schema, the profile itself and the groups of
+  attributes, are `Node` objects, a tuple of values and a `Shape` holding
+  the keys, shared by all the objects with the same keys. Objects with
+  arbitrary keys, like access groups or URIs, are kept as dicts
+* lists are tuples
+* the classifications, display levels and publishers are interned, so
+  profiles loaded from JSON share them like generated ones do
+
+Compact objects are read-only mappings with the same keys as the dicts they
+stand for, the metadata and signature of an envelope are built on access.
+They are converted back to dicts only at the edge, with `to_dict` or
+`from_compact`, and the serializers convert them on their own.
+"""
+import abc
+import sys
+from collections.abc import Mapping
+
+# Largest number of shapes, profiles with more variations of the schema
+# objects than this keep the other ones as dicts
+MAX_SHAPES = 1024
+
+# Positions of the objects of the profile schema: the keys of the objects
+# nested in the profile that are schema objects too
+SCHEMA = {
+    'access_information': {'hris': {'values': {}}},
+    'identities': {},
+    'staff_information': {},
+}
+
+METADATA_KEYS = ('classification', 'display', 'last_modified', 'created', 'verified')
+SIGNATURE_KEYS = ('publisher', 'additional')
+PUBLISHER_KEYS = ('alg', 'typ', 'value', 'name')
+ENVELOPE_KEYS = {
+    ('value', 'metadata', 'signature'): 'value',
+    ('values', 'metadata', 'signature'): 'values',
+}
+
+# Shapes keyed by their keys
+_shapes = {}
+
+
+def _intern(value):
+    return sys.intern(value) if value.__class__ is str else value
+
+
+class Shape(object):
+    """Keys of `Node` objects and the position of their values."""
+
+    __slots__ = ('keys', 'positions')
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.positions = dict((key, position) for position, key in enumerate(keys))
+
+
+def _shape(keys):
+    """Return the shared `Shape` of `keys`, None if there are too many shapes already."""
+    shape = _shapes.get(keys)
+    if shape is None and len(_shapes) < MAX_SHAPES:
+        shape = _shapes[keys] = Shape(tuple(sys.intern(key) for key in keys))
+    return shape
+
+
+class CompactObject(Mapping):
+    """Read-only mapping standing for a dict of a profile."""
+
+    __slots__ = ()
+
+    @abc.abstractmethod
+    def to_dict(self):
+        """Return the object as nested dicts and lists."""
+
+    def __eq__(self, other):
+        if isinstance(other, CompactObject):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '{0}({1!r})'.format(self.__class__.__name__, self.to_dict())
+
+
+class Node(CompactObject):
+    """Object of the profile schema, its values in the order of the keys of its `Shape`."""
+
+    __slots__ = ('shape', 'data')
+
+    def __init__(self, shape, data):
+        self.shape = shape
+        self.data = data
+
+    def __getitem__(self, key):
+        return self.data[self.shape.positions[key]]
+
+    def __iter__(self):
+        return iter(self.shape.keys)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.shape.positions
+
+    def to_dict(self):
+        return dict(zip(self.shape.keys, [from_compact(item) for item in self.data]))
+
+
+class Publisher(CompactObject):
+    """Publisher of a signature."""
+
+    __slots__ = PUBLISHER_KEYS
+
+    def __init__(self, alg, typ, value, name):
+        self.alg = _intern(alg)
+        self.typ = _intern(typ)
+        self.value = value
+        self.name = _intern(name)
+
+    def __getitem__(self, key):
+        if key not in PUBLISHER_KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(PUBLISHER_KEYS)
+
+    def __len__(self):
+        return len(PUBLISHER_KEYS)
+
+    def to_dict(self):
+        return {'alg': self.alg, 'typ': self.typ, 'value': self.value, 'name': self.name}
+
+
+class Envelope(CompactObject):
+    """Value wrapped with its metadata and signature.
+
+    `key` is 'values' for dict and list values, 'value' otherwise.
+    """
+
+    __slots__ = ('key', 'value') + METADATA_KEYS + SIGNATURE_KEYS
+
+    def __init__(self, key, value, classification, display, last_modified, created, verified,
+                 publisher, additional=()):
+        self.key = key
+        self.value = value
+        self.classification = _intern(classification)
+        self.display = _intern(display)
+        self.last_modified = last_modified
+        self.created = created
+        self.verified = verified
+        self.publisher = publisher
+        self.additional = additional
+
+    @classmethod
+    def from_dict(cls, obj, schema=None):
+        """Return the `Envelope` of dict `obj`, None if it is not an envelope.
+
+        `schema` are the positions of the schema objects in the envelope.
+        """
+        key = ENVELOPE_KEYS.get(tuple(obj))
+        if key is None:
+            return None
+        metadata, signature = obj['metadata'], obj['signature']
+        if not (isinstance(metadata, dict) and tuple(metadata) == METADATA_KEYS and
+                isinstance(signature, dict) and tuple(signature) == SIGNATURE_KEYS and
+                isinstance(signature['additional'], list)):
+            return None
+        publishers = [signature['publisher']] + signature['additional']
+        if not all(isinstance(publisher, dict) and tuple(publisher) == PUBLISHER_KEYS
+                   for publisher in publishers):
+            return None
+        publishers = [Publisher(**publisher) for publisher in publishers]
+        value = _compact(obj[key], schema.get(key) if schema is not None else None)
+        return cls(key, value, publisher=publishers[0],
+                   additional=tuple(publishers[1:]), **metadata)
+
+    @property
+    def metadata(self):
+        return {
+            'classification': self.classification,
+            'display': self.display,
+            'last_modified': self.last_modified,
+            'created': self.created,
+            'verified': self.verified,
+        }
+
+    @property
+    def signature(self):
+        return {
+            'publisher': self.publisher.to_dict(),
+            'additional': [publisher.to_dict() for publisher in self.additional],
+        }
+
+    def __getitem__(self, key):
+        if key == self.key:
+            return self.value
+        if key in ('metadata', 'signature'):
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter((self.key, 'metadata', 'signature'))
+
+    def __len__(self):
+        return 3
+
+    def to_dict(self):
+        return {
+            self.key: from_compact(self.value),
+            'metadata': self.metadata,
+            'signature': self.signature,
+        }
+
+
+def _compact(value, schema):
+    # `schema` are the positions of the schema objects in `value`, None if
+    # `value` is not a schema object
+    if isinstance(value, dict):
+        envelope = Envelope.from_dict(value, schema)
+        if envelope is not None:
+            return envelope
+        if schema is None:
+            return dict((key, _compact(item, None)) for key, item in value.items())
+        items = tuple([_compact(item, schema.get(key)) for key, item in value.items()])
+        shape = _shape(tuple(value))
+        if shape is None:
+            return dict(zip(value, items))
+        return Node(shape, items)
+    if value.__class__ is list:
+        return tuple([_compact(item, None) for item in value])
+    return value
+
+
+def to_compact(profile):
+    """Return the compact representation of the profile v2 object `profile`."""
+    return _compact(profile, SCHEMA)
+
+
+def from_compact(value):
+    """Return the JSON value, nested dicts and lists, of the compact `value`."""
+    if isinstance(value, CompactObject):
+        return value.to_dict()
+    if value.__class__ is tuple:
+        return [from_compact(item) for item in value]
+    if value.__class__ is dict:
+        return dict((key, from_compact(item)) for key, item in value.items())
+    return value
@@ -1,8 +1,17 @@
+import collections
+import datetime
 import itertools
-import json
+import multiprocessing
 import random
+import threading
+import timeit
+from collections.abc import Mapping
 
-from faker import Faker
+from iam_profile_faker.compact import to_compact
+from iam_profile_faker.envelope import EnvelopeGenerator
+from iam_profile_faker.serializers import get_serializer
+from iam_profile_faker.vocabulary import get_vocabulary
+from iam_profile_faker.writers import write_batch
 
 C_NDAED = 'MOZILLA CONFIDENTIAL'
 C_STAFF = 'WORKGROUP CONFIDENTIAL: STAFF ONLY'
@@ -10,6 +19,24 @@ C_GROUP = 'WORKGROUP CONFIDENTIAL'
 C_PUBLIC = 'PUBLIC'
 C_PRIVATE = 'INDIVIDUAL CONFIDENTIAL'
 
+# Number of profiles generated by a worker process in one go in parallel mode
+SHARD_SIZE = 1000
+
+# Faker providers used by IAMFaker, loading only these makes Faker instances
+# several times cheaper to build
+FAKER_PROVIDERS = [
+    'faker.providers.{0}'.format(name)
+    for name in ('person', 'internet', 'company', 'phone_number', 'lorem', 'python', 'misc',
+                 'date_time')
+]
+
+# Batch generation engines, see `V2ProfileFactory.iter_batch`
+ENGINES = ['default', 'bulk', 'template']
+
+# Reference point in time used instead of "now" by seeded generation, so that
+# the generated dates do not depend on when the generation runs
+SEED_REFERENCE_TIME = datetime.datetime(2019, 1, 1)
+
 DISPLAY = [
     'public',
     'authenticated',
@@ -19,22 +46,94 @@ DISPLAY = [
     'private'
 ]
 
+LOGIN_METHODS = [
+    'email', 'github', 'google-oauth2', 'ad|Mozilla-LDAP', 'oauth2|firefoxaccounts'
+]
+
+IDENTITIES = [
+    ('github_id_v3', DISPLAY),
+    ('github_id_v4', DISPLAY),
+    ('dinopark_id', ['public']),
+    ('mozilliansorg_id', DISPLAY),
+    ('bugzilla_mozilla_org_id', DISPLAY),
+    ('mozilla_ldap_id', ['staff']),
+    ('mozilla_posix_id', DISPLAY),
+    ('google_oauth2_id', DISPLAY),
+    ('firefox_accounts_id', DISPLAY),
+]
+
+ACCESS_PUBLISHERS = [
+    ('ldap', C_PUBLIC),
+    ('mozilliansorg', C_PUBLIC),
+    ('access_provider', C_GROUP)
+]
+
+OFFICE_LOCATIONS = [
+    'Berlin', 'Paris', 'London', 'Toronto', 'Mountain View',
+    'San Francisco', 'Vancouver', 'Portland', 'Beijing', 'Taipei'
+]
+
+PRONOUNS = [None, 'he/him', 'she/her', 'they/them']
+
+MANAGEMENT_LEVELS = ['Junior', 'Senior', 'Staff']
+
+WORKER_TYPES = ['Employee', 'Seasonal', 'Geocontractor']
+
+# external accounts supported by DinoPark, prefixed with EA#
+EXTERNAL_ACCOUNTS = [
+    "EA#AIM",
+    "EA#BITBUCKET",
+    "EA#BMO",
+    "EA#DISCORD",
+    "EA#FACEBOOK",
+    "EA#LANYRD",
+    "EA#LINKEDIN",
+    "EA#MDN",
+    "EA#MASTODON",
+    "EA#AMO",
+    "EA#DISCOURSE",
+    "EA#MOZPHAB",
+    "EA#MOZILLAPONTOON",
+    "EA#REMO",
+    "EA#SUMO",
+    "EA#WEBMAKER",
+    "EA#MOZILLAWIKI",
+    "EA#Phone",
+    "EA#Phone",
+    "EA#SKYPE",
+    "EA#SLIDESHARE",
+    "EA#TELEGRAM",
+    "EA#TRANSIFEX",
+    "EA#TWITTER",
+    "EA#WEBSITE",
+    "EA#JABBER",
+    "EA#YAHOO",
+]
+
 
 def wrap_metadata_signature(obj, value, display=DISPLAY, c12n=C_GROUP):
     """Wrap profile value with metadata/signature"""
 
+    instrumentation = getattr(obj, 'instrumentation', None)
+    if instrumentation is not None:
+        start = timeit.default_timer()
+
     # Value key varies based on the type of the value
     if isinstance(value, dict) or isinstance(value, list):
         value_key = 'values'
     else:
         value_key = 'value'
 
-    return {
+    wrapped = {
         value_key: value,
         'metadata': obj.metadata(display, c12n),
         'signature': obj.signature()
     }
 
+    if instrumentation is not None:
+        instrumentation.record('wrap_metadata_signature', timeit.default_timer() - start)
+    return wrapped
+
 
 def decorate_metadata_signature(display=DISPLAY, c12n=C_GROUP):
     def wrap(fun):
@@ -46,22 +145,134 @@ def decorate_metadata_signature(display=DISPLAY, c12n=C_GROUP):
     return wrap
 
 
-def create_random_hierarchy_iter():
-    """Generate hierarchy iterator with a random pattern"""
+def derive_seed(seed, index, *names):
+    """Derive the seed of the `index`-th item generated from `seed`.
+
+    String seeds are hashed with SHA-512 by `random.Random`, so derived seeds
+    are stable across processes, platforms and Python versions.
+    """
+    return ':'.join(str(part) for part in (seed, index) + names)
+
+
+def create_random_hierarchy_iter(start=0, seed=None):
+    """Generate hierarchy iterator with a random pattern
+
+    Iteration begins at position `start` so that a shard of a batch can
+    produce its own slice of the global EmployeeID range. Managers are always
+    picked among the employees that precede the current one. If `seed` is
+    given the manager of every position is derived from it independently.
+    """
     def gen():
-        for i in itertools.count():
-            yield (i + 1, random.randint(0, i))
+        rng = random.Random() if seed is not None else random
+        for i in itertools.count(start):
+            if seed is not None:
+                rng.seed(derive_seed(seed, i, 'hierarchy'))
+            yield (i + 1, rng.randint(0, i))
     return gen()
 
 
+def iter_hierarchy(start, count, seed=None, org=None):
+    """Return the hierarchy iterator of the positions `start` to `start + count` of a batch.
+
+    The positions come from the `OrgHierarchy` `org` if given, see
+    `iam_profile_faker.hierarchy`, from `create_random_hierarchy_iter` otherwise.
+    """
+    if org is not None:
+        return org.positions(start, count)
+    return create_random_hierarchy_iter(start, seed)
+
+
+def _iter_engine(engine, start, count, seed=None, instrumentation=None, org=None):
+    """Yield the profiles `start` to `start + count` of a batch made by `engine`."""
+    if engine == 'bulk':
+        from iam_profile_faker.bulk import iter_bulk_profiles
+        return iter_bulk_profiles(count, start=start, seed=seed, org=org)
+    if engine == 'template':
+        from iam_profile_faker.template import iter_template_profiles
+        return iter_template_profiles(count, start=start, seed=seed, org=org)
+    if engine != 'default':
+        raise ValueError('Unknown engine {0}'.format(engine))
+
+    faker = IAMFaker(hierarchy=iter_hierarchy(start, count, seed, org), seed=seed,
+                     instrumentation=instrumentation)
+    return (faker.create(index=index) for index in range(start, start + count))
+
+
+def _iter_engine_encoded(engine, start, count, dumps_bytes, seed=None, instrumentation=None,
+                         org=None):
+    """Yield the profiles of `_iter_engine` serialized to JSON bytes with `dumps_bytes`.
+
+    The `template` engine renders its profiles itself.
+    """
+    if engine == 'template':
+        from iam_profile_faker.template import iter_template_profiles
+        return iter_template_profiles(count, start=start, seed=seed, encoded=True, org=org)
+    return (dumps_bytes(obj) for obj in _iter_engine(engine, start, count, seed=seed,
+                                                     instrumentation=instrumentation, org=org))
+
+
+def _create_shard(shard):
+    """Generate the profiles of a single shard in a worker process.
+
+    If a serializer name is given the profiles are returned serialized, which
+    is also cheaper to send back to the parent process.
+    """
+    seed, start, count, serializer, engine, org = shard
+    if serializer:
+        dumps_bytes = get_serializer(serializer).dumps_bytes
+        return list(_iter_engine_encoded(engine, start, count, dumps_bytes, seed=seed, org=org))
+    return list(_iter_engine(engine, start, count, seed=seed, org=org))
+
+
 class IAMFaker(object):
-    def __init__(self, locale=None, hierarchy=None):
-        self.fake = Faker(locale)
+    # Generator methods timed when instrumentation is enabled
+    INSTRUMENTED = [
+        'get_public_email_address', 'metadata', 'signature', 'login_method', 'user_id',
+        'usernames', 'identities', 'ssh_public_keys', 'pgp_public_keys',
+        'access_information', 'languages', 'pronouns', 'uris', 'phone_numbers',
+        'staff_information', 'hris', 'create',
+    ]
+
+    def __init__(self, locale=None, hierarchy=None, now=None, seed=None,
+                 instrumentation=None):
+        # Faker is imported on first use, it takes most of the import time
+        from faker import Faker
+
+        # All the randomness, including Faker's, comes from this instance
+        self.random = random.Random()
+        self.fake = Faker(locale, providers=FAKER_PROVIDERS)
+        self.fake.random = self.random
+        # Pools of the values of the small Faker vocabularies
+        self.vocabulary = get_vocabulary(locale)
+        self.envelope = EnvelopeGenerator(self.random)
+        self.configure(seed=seed, hierarchy=hierarchy, now=now)
+
+        # Optional `Instrumentation` recording the cost of every generator,
+        # methods are only wrapped when it is enabled
+        self.instrumentation = instrumentation
+        if instrumentation is not None:
+            for name in self.INSTRUMENTED:
+                setattr(self, name, instrumentation.wrap(name, getattr(self, name)))
+
+    def configure(self, seed=None, hierarchy=None, now=None):
+        """Reset the seed, hierarchy and reference time so that the instance can be reused."""
+        if seed is not None and now is None:
+            now = SEED_REFERENCE_TIME
+
+        self.seed = seed
+        self.random.seed(seed)
         self.hierarchy = hierarchy
+        # Upper bound of generated dates, defaults to the current time
+        self.now = now
+        self.envelope.now = now
+
+    def pick(self, name):
+        """Return a value of the Faker provider `name` from the vocabulary pools."""
+        return self.vocabulary.choice(name, self.random)
 
     def get_public_email_address(self):
         value = []
-        for _ in range(random.randint(0, 5)):
+        for _ in range(self.random.randint(0, 5)):
             value.append(self.fake.email())
 
         return value
@@ -72,42 +283,16 @@ class IAMFaker(object):
 
     def metadata(self, display=DISPLAY, c12n=C_GROUP):
         """Generate field metadata"""
-
-        created = self.fake.date_time()
-        last_modified = self.fake.date_time_between_dates(datetime_start=created)
-
-        return {
-            'classification': c12n,
-            'display': random.choice(display),
-            'last_modified': last_modified.isoformat(),
-            'created': created.isoformat(),
-            'verified': self.fake.pybool(),
-        }
+        return self.envelope.metadata(display, c12n)
 
     def signature(self):
         """Generate field signature"""
-
-        def _gen_signature():
-            return {
-                'alg': 'RS256',
-                'typ': 'JWS',
-                'value': '{}.{}.{}'.format(self.fake.pystr(), self.fake.pystr(),
-                                           self.fake.pystr()),
-                'name': random.choice(['access_provider', 'ldap', 'hris', 'cis', 'mozilliansorg'])
-            }
-
-        return {
-            'publisher': _gen_signature(),
-            'additional': [_gen_signature() for i in range(random.randint(0, 5))]
-        }
+        return self.envelope.signature()
 
     @decorate_metadata_signature(c12n=C_PUBLIC)
     def login_method(self):
         """Profile v2 login_method faker."""
-        login_methods = [
-            'email', 'github', 'google-oauth2', 'ad|Mozilla-LDAP', 'oauth2|firefoxaccounts'
-        ]
-        return random.choice(login_methods)
+        return self.random.choice(LOGIN_METHODS)
 
     @decorate_metadata_signature(c12n=C_PUBLIC)
     def user_id(self, login_method=None):
@@ -125,37 +310,28 @@ class IAMFaker(object):
                 if uid.startswith(login_method['value']):
                     return uid
 
-        return random.choice(user_ids)
+        return self.random.choice(user_ids)
 
     @decorate_metadata_signature(display=["public"], c12n=C_GROUP)
     def usernames(self):
         """Profile v2 usernames faker."""
         values = {}
         values["mozilliansorg"] = self.fake.user_name()
-        for _ in range(random.randint(0, 5)):
+        for _ in range(self.random.randint(0, 5)):
             values[self.fake.slug()] = self.fake.user_name()
 
         return values
 
     def identities(self):
         """Profile v2 identities faker."""
-        return {
-            'github_id_v3': wrap_metadata_signature(self, self.fake.md5()),
-            'github_id_v4': wrap_metadata_signature(self, self.fake.md5()),
-            'dinopark_id': wrap_metadata_signature(self, self.fake.md5(), display=["public"]),
-            'mozilliansorg_id': wrap_metadata_signature(self, self.fake.md5()),
-            'bugzilla_mozilla_org_id': wrap_metadata_signature(self, self.fake.md5()),
-            'mozilla_ldap_id': wrap_metadata_signature(self, self.fake.md5(), display=["staff"]),
-            'mozilla_posix_id': wrap_metadata_signature(self, self.fake.md5()),
-            'google_oauth2_id': wrap_metadata_signature(self, self.fake.md5()),
-            'firefox_accounts_id': wrap_metadata_signature(self, self.fake.md5()),
-        }
+        return dict((name, wrap_metadata_signature(self, self.fake.md5(), display=display))
+                    for name, display in IDENTITIES)
 
     @decorate_metadata_signature(c12n=C_PUBLIC)
     def ssh_public_keys(self):
         """Profile v2 public SSH key faker."""
         values = {}
-        for _ in range(random.randint(0, 5)):
+        for _ in range(self.random.randint(0, 5)):
             content = self.fake.pystr(min_chars=250, max_chars=500)
             email = self.fake.email()
             values[self.fake.slug()] = 'ssh-rsa {} {}'.format(content, email)
@@ -166,7 +342,7 @@ class IAMFaker(object):
     def pgp_public_keys(self):
         """Profile v2 public PGP key faker."""
         values = {}
-        for _ in range(random.randint(0, 5)):
+        for _ in range(self.random.randint(0, 5)):
             pgp_key = '-----BEGIN PGP PUBLIC KEY BLOCK-----\n\n'
             pgp_key += self.fake.pystr(min_chars=250, max_chars=500)
             pgp_key += '\n-----END PGP PUBLIC KEY BLOCK-----\n'
@@ -174,92 +350,54 @@ class IAMFaker(object):
 
         return values
 
-    def access_information(self):
-        """Profile v2 access information faker."""
+    def access_values(self, publisher):
+        """Profile v2 access information faker of a publisher other than HRIS."""
         values = {}
-        publishers_c12n = [
-            ('ldap', C_PUBLIC),
-            ('mozilliansorg', C_PUBLIC),
-            ('access_provider', C_GROUP)
-        ]
-        for (publisher, c12n) in publishers_c12n:
-            v = {}
-            for _ in range(random.randint(1, 5)):
-                if publisher == 'mozilliansorg':
-                    v[self.fake.slug()] = None
-                else:
-                    v[self.fake.slug()] = self.fake.pybool()
+        for _ in range(self.random.randint(1, 5)):
+            if publisher == 'mozilliansorg':
+                values[self.fake.slug()] = None
+            else:
+                values[self.fake.slug()] = self.fake.pybool()
+        return values
 
+    def access_information(self, hris=None):
+        """Profile v2 access information faker, `hris` are the HRIS values if already generated."""
+        values = {}
+        for (publisher, c12n) in ACCESS_PUBLISHERS:
             values[publisher] = wrap_metadata_signature(
-                self, v, display=[None], c12n=c12n)
+                self, self.access_values(publisher), display=[None], c12n=c12n)
 
         values['hris'] = wrap_metadata_signature(
-            self, self.hris(), display=[None], c12n=C_STAFF)
+            self, self.hris() if hris is None else hris, display=[None], c12n=C_STAFF)
 
         return values
 
     def office_location(self):
         """Profile v2 office location faker."""
-        locations = [
-            'Berlin', 'Paris', 'London', 'Toronto', 'Mountain View',
-            'San Francisco', 'Vancouver', 'Portland', 'Beijing', 'Taipei'
-        ]
-
-        return random.choice(locations)
+        return self.random.choice(OFFICE_LOCATIONS)
 
     @decorate_metadata_signature()
     def languages(self):
         """Profile v2 preferred languages faker."""
         values = []
-        for _ in range(random.randint(0, 5)):
-            values.append(self.fake.language_code())
+        for _ in range(self.random.randint(0, 5)):
+            values.append(self.pick('language_code'))
 
         return values
 
     @decorate_metadata_signature()
     def pronouns(self):
         """Profile v2 pronouns faker."""
-        return random.choice([None, 'he/him', 'she/her', 'they/them'])
+        return self.random.choice(PRONOUNS)
 
     @decorate_metadata_signature()
     def uris(self):
         """Profile v2 URIs faker."""
 
-        # external accounts supported by DinoPark, prefixed with EA#
-        external_accounts = [
-            "EA#AIM",
-            "EA#BITBUCKET",
-            "EA#BMO",
-            "EA#DISCORD",
-            "EA#FACEBOOK",
-            "EA#LANYRD",
-            "EA#LINKEDIN",
-            "EA#MDN",
-            "EA#MASTODON",
-            "EA#AMO",
-            "EA#DISCOURSE",
-            "EA#MOZPHAB",
-            "EA#MOZILLAPONTOON",
-            "EA#REMO",
-            "EA#SUMO",
-            "EA#WEBMAKER",
-            "EA#MOZILLAWIKI",
-            "EA#Phone",
-            "EA#Phone",
-            "EA#SKYPE",
-            "EA#SLIDESHARE",
-            "EA#TELEGRAM",
-            "EA#TRANSIFEX",
-            "EA#TWITTER",
-            "EA#WEBSITE",
-            "EA#JABBER",
-            "EA#YAHOO",
-        ]
-
         values = {}
-        for name in random.sample(external_accounts, random.randint(0, 4)):
+        for name in self.random.sample(EXTERNAL_ACCOUNTS, self.random.randint(0, 4)):
             values[name] = self.fake.uri()
-        for _ in range(random.randint(0, 4)):
+        for _ in range(self.random.randint(0, 4)):
             values[self.fake.slug()] = self.fake.uri()
 
         return values
@@ -268,7 +406,7 @@ class IAMFaker(object):
     def phone_numbers(self):
         """Profile v2 phone_numbers faker."""
         values = {}
-        for _ in range(random.randint(0, 5)):
+        for _ in range(self.random.randint(0, 5)):
             values[self.fake.slug()] = self.fake.phone_number()
 
         return values
@@ -297,112 +435,367 @@ class IAMFaker(object):
         """Profile v2 HRIS faker"""
 
         def get_management_level():
-            level = random.choice(['Junior', 'Senior', 'Staff'])
-            return random.choice(['{} Manager'.format(level), ''])
+            level = self.random.choice(MANAGEMENT_LEVELS)
+            return self.random.choice(['{} Manager'.format(level), ''])
 
         employee_id, manager_id = (next(self.hierarchy)
                                    if self.hierarchy
                                    else (self.fake.pyint(), self.fake.pyint()))
 
         values = {
-            'LastName': self.fake.last_name(),
+            'LastName': self.pick('last_name'),
             'Preferred_Name': self.fake.name(),
-            'PreferredFirstName': self.fake.first_name(),
-            'LegalFirstName': self.fake.first_name(),
+            'PreferredFirstName': self.pick('first_name'),
+            'LegalFirstName': self.pick('first_name'),
             'EmployeeID': employee_id,
-            'businessTitle': self.fake.job(),
+            'businessTitle': self.pick('job'),
             'IsManager': self.fake.pybool(),
             'isDirectorOrAbove': self.fake.pybool(),
             'Management_Level': get_management_level(),
-            'HireDate': self.fake.date(pattern="%Y-%m-%d", end_datetime=None),
-            'CurrentlyActive': random.choice(['0', '1']),
-            'Entity': self.fake.company(),
-            'Team': '{} team'.format(self.fake.color_name()),
-            'Cost_Center': '{} - {}'.format(self.fake.pyint(), self.fake.job()),
-            'WorkerType': random.choice(['Employee', 'Seasonal', 'Geocontractor']),
-            'Location_Description': random.choice([
-                'Berlin', 'Paris', 'London', 'Toronto', 'Mountain View',
-                'San Francisco', 'Vancouver', 'Portland', 'Beijing', 'Taipei'
-            ]),
-            'Time_Zone': self.fake.timezone(),
-            'LocationCity': self.fake.city(),
-            'LocationState': self.fake.state(),
-            'LocationCountryFull': self.fake.country(),
-            'LocationCountryISO2': self.fake.country_code(),
+            'HireDate': self.fake.date(pattern="%Y-%m-%d", end_datetime=self.now),
+            'CurrentlyActive': self.random.choice(['0', '1']),
+            'Entity': self.pick('company'),
+            'Team': '{} team'.format(self.pick('color_name')),
+            'Cost_Center': '{} - {}'.format(self.fake.pyint(), self.pick('job')),
+            'WorkerType': self.random.choice(WORKER_TYPES),
+            'Location_Description': self.random.choice(OFFICE_LOCATIONS),
+            'Time_Zone': self.pick('timezone'),
+            'LocationCity': self.pick('city'),
+            'LocationState': self.pick('state'),
+            'LocationCountryFull': self.pick('country'),
+            'LocationCountryISO2': self.pick('country_code'),
             'WorkersManager': 'unknown',
             'WorkersManagersEmployeeID': manager_id,
             'Worker_s_Manager_s_Email_Address': self.fake.email(),
             'primary_work_email': self.fake.email(),
             'WPRDeskNumber': str(self.fake.pyint()),
-            'EgenciaPOSCountry': self.fake.country_code(),
+            'EgenciaPOSCountry': self.pick('country_code'),
             'PublicEmailAddresses': self.get_public_email_address()
         }
 
+        org = getattr(self.hierarchy, 'org', None)
+        if org is not None:
+            org.update_hris(values)
         return values
 
-    def create(self):
-        """Method to generate fake profile v2 objects."""
-        login_method = self.login_method()
-        created = self.fake.date_time()
-        last_modified = self.fake.date_time_between_dates(datetime_start=created)
-
-        user_id = self.user_id(login_method=login_method)
-        user_id["metadata"]["display"] = "public"
-
-        access_information = self.access_information()
-        obj = {
-            'access_information': access_information,
-            'active': wrap_metadata_signature(self, self.fake.pybool(), display=[None]),
-            'alternative_name': wrap_metadata_signature(self, self.fake.name()),
-            'created': wrap_metadata_signature(self, created.isoformat(), c12n=C_PUBLIC),
-            'description': wrap_metadata_signature(self, self.fake.paragraph()),
-            'first_name': wrap_metadata_signature(self, self.fake.first_name(), c12n=C_PUBLIC),
-            'fun_title': wrap_metadata_signature(self, self.fake.sentence()),
-            'identities': self.identities(),
-            'languages': self.languages(),
-            'last_modified': wrap_metadata_signature(self,
-                                                     last_modified.isoformat(),
-                                                     c12n=C_PUBLIC),
-            'last_name': wrap_metadata_signature(self, self.fake.last_name(), c12n=C_PUBLIC),
-            'location': wrap_metadata_signature(self, self.fake.country()),
-            'login_method': login_method,
-            'pgp_public_keys': self.pgp_public_keys(),
-            'phone_numbers': self.phone_numbers(),
-            'picture': wrap_metadata_signature(self, None, c12n=C_PUBLIC),
-            'primary_email': wrap_metadata_signature(self, self.fake.email(), c12n=C_PUBLIC),
-            'pronouns': self.pronouns(),
-            'schema': self.schema(),
-            'ssh_public_keys': self.ssh_public_keys(),
-            'staff_information': self.staff_information(access_information['hris']['values']),
-            'tags': wrap_metadata_signature(self, self.fake.words()),
-            'timezone': wrap_metadata_signature(self, self.fake.timezone()),
-            'uris': self.uris(),
-            'user_id': user_id,
-            'usernames': self.usernames(),
-        }
+    def create(self, index=None):
+        """Method to generate fake profile v2 objects.
+
+        If the faker is seeded and `index` is given, the profile only depends
+        on the seed and `index`, so any profile of a seeded batch can be
+        regenerated on its own, and it is the same as the `LazyProfile` of
+        the seed and `index`.
+        """
+        seed = self.seed if index is not None else None
+        return LazyProfile(self, seed=seed, index=index or 0, hierarchy=self.hierarchy,
+                           now=self.now).materialize()
+
+
+def _dates(faker):
+    created = faker.fake.date_time(end_datetime=faker.now)
+    last_modified = faker.fake.date_time_between_dates(datetime_start=created,
+                                                       datetime_end=faker.now)
+    return created.isoformat(), last_modified.isoformat()
+
+
+def _user_id(faker, login_method):
+    user_id = faker.user_id(login_method=login_method)
+    user_id['metadata']['display'] = 'public'
+    return user_id
+
+
+def _wrap(generate, **kwargs):
+    """Return a field generator wrapping the value drawn by `generate(faker)`."""
+    return lambda faker: wrap_metadata_signature(faker, generate(faker), **kwargs)
+
+
+def _method(name):
+    """Return a field generator calling `IAMFaker` method `name`."""
+    return lambda faker, *dependencies: getattr(faker, name)(*dependencies)
+
+
+def _person(attribute, generate):
+    """Return a field generator of a name or email of the employee of the HRIS values.
+
+    With an `OrgHierarchy` it is the `attribute` of the employee's `Person`,
+    which the HRIS records of the reports refer to, otherwise the value
+    drawn by `generate(faker)`.
+    """
+    def generator(faker, hris):
+        org = getattr(faker.hierarchy, 'org', None)
+        if org is None:
+            value = generate(faker)
+        else:
+            value = getattr(org.person(hris['EmployeeID']), attribute)
+        return wrap_metadata_signature(faker, value, c12n=C_PUBLIC)
+    return generator
+
+
+def _date(position):
+    """Return a field generator wrapping the created (0) or last modified (1) date."""
+    return lambda faker, dates: wrap_metadata_signature(faker, dates[position], c12n=C_PUBLIC)
+
+
+# Generators of the top-level fields of a profile v2 object, in the order of
+# the serialized profiles, and the fields they depend on. Generators are
+# called with the faker and the values of these fields. Names starting with
+# an underscore are intermediate values shared by several fields.
+FIELD_GENERATORS = collections.OrderedDict([
+    ('access_information', (_method('access_information'), ['_hris'])),
+    ('active', (_wrap(lambda faker: faker.fake.pybool(), display=[None]), [])),
+    ('alternative_name', (_wrap(lambda faker: faker.fake.name()), [])),
+    ('created', (_date(0), ['_dates'])),
+    ('description', (_wrap(lambda faker: faker.fake.paragraph()), [])),
+    ('first_name', (_person('first_name', lambda faker: faker.pick('first_name')), ['_hris'])),
+    ('fun_title', (_wrap(lambda faker: faker.fake.sentence()), [])),
+    ('identities', (_method('identities'), [])),
+    ('languages', (_method('languages'), [])),
+    ('last_modified', (_date(1), ['_dates'])),
+    ('last_name', (_person('last_name', lambda faker: faker.pick('last_name')), ['_hris'])),
+    ('location', (_wrap(lambda faker: faker.pick('country')), [])),
+    ('login_method', (_method('login_method'), [])),
+    ('pgp_public_keys', (_method('pgp_public_keys'), [])),
+    ('phone_numbers', (_method('phone_numbers'), [])),
+    ('picture', (_wrap(lambda faker: None, c12n=C_PUBLIC), [])),
+    ('primary_email', (_person('email', lambda faker: faker.fake.email()), ['_hris'])),
+    ('pronouns', (_method('pronouns'), [])),
+    ('schema', (_method('schema'), [])),
+    ('ssh_public_keys', (_method('ssh_public_keys'), [])),
+    ('staff_information', (_method('staff_information'), ['_hris'])),
+    ('tags', (_wrap(lambda faker: faker.fake.words()), [])),
+    ('timezone', (_wrap(lambda faker: faker.pick('timezone')), [])),
+    ('uris', (_method('uris'), [])),
+    ('user_id', (_user_id, ['login_method'])),
+    ('usernames', (_method('usernames'), [])),
+    ('_dates', (_dates, [])),
+    ('_hris', (_method('hris'), [])),
+])
+
+# Top-level fields of a profile v2 object
+FIELDS = [name for name in FIELD_GENERATORS if not name.startswith('_')]
+
+
+class LazyProfile(Mapping):
+    """Profile v2 object whose top-level fields are generated on first access.
+
+    With a `seed`, every field is generated by `faker` from its own seed,
+    derived from `seed`, `index` and the field name, so fields can be
+    generated in any order and the profile is the same as the eagerly
+    created one. Without a seed the fields come from the current state of
+    the faker, which is only meant to generate them all at once. Fields are
+    memoized, `dict(profile)` or `materialize` generates the missing ones and
+    serializers materialize lazy profiles on their own.
+    """
+
+    def __init__(self, faker, seed=None, index=0, hierarchy=None, now=None):
+        self.faker = faker
+        self.seed = seed
+        self.index = index
+        self.hierarchy = hierarchy
+        self.now = now
+        self._values = {}
+
+    def value(self, name):
+        """Return the value of field `name`, including the intermediate ones."""
+        try:
+            return self._values[name]
+        except KeyError:
+            pass
+
+        # Dependencies are generated first, since they reseed the faker
+        generate, dependencies = FIELD_GENERATORS[name]
+        dependencies = [self.value(dependency) for dependency in dependencies]
+
+        # The faker may be shared with other profiles
+        faker = self.faker
+        faker.hierarchy = self.hierarchy
+        faker.now = faker.envelope.now = self.now
+        if self.seed is not None:
+            faker.random.seed(derive_seed(self.seed, self.index, name))
+        value = self._values[name] = generate(faker, *dependencies)
+        return value
+
+    def __getitem__(self, name):
+        if name not in FIELD_GENERATORS or name.startswith('_'):
+            raise KeyError(name)
+        return self.value(name)
 
-        return obj
+    def __iter__(self):
+        return iter(FIELDS)
+
+    def __len__(self):
+        return len(FIELDS)
+
+    def materialize(self):
+        """Return the profile as a dict, generating the missing fields."""
+        return dict((name, self.value(name)) for name in FIELDS)
 
 
 class V2ProfileFactory(object):
-    def create(self, export_json=False):
-        """Generate fake profile v2 object."""
-        faker = IAMFaker()
-        output = faker.create()
+    def __init__(self, instrumentation=None, serializer=None):
+        # Passed to the fakers generating profiles in this process, profiles
+        # generated in worker processes are not instrumented
+        self.instrumentation = instrumentation
+        # JSON backend used to export profiles, see `serializers.get_serializer`
+        self.serializer = get_serializer(serializer)
+        self._local = threading.local()
+
+    def _faker(self):
+        """Return the `IAMFaker` of the current thread, built on first use.
+
+        Fakers are not thread safe, so the factory can be shared by the
+        threads of a server as long as each thread has its own.
+        """
+        faker = getattr(self._local, 'faker', None)
+        if faker is None:
+            faker = self._local.faker = IAMFaker(instrumentation=self.instrumentation)
+        return faker
+
+    def create(self, export_json=False, seed=None, index=0, as_bytes=False):
+        """Generate fake profile v2 object.
+
+        With a `seed`, the result is the same as the `index`-th profile of a
+        batch created with that seed. With `export_json` the profile is
+        returned serialized, as UTF-8 encoded bytes if `as_bytes` is set.
+        """
+        faker = self._faker()
+        if seed is None:
+            # Reseeded from the OS on every call, which also keeps forked
+            # processes sharing the factory from generating the same profiles
+            faker.configure()
+        else:
+            faker.configure(seed=seed, hierarchy=create_random_hierarchy_iter(index, seed))
+        output = faker.create(index=index)
 
         if export_json:
-            return json.dumps(output)
+            if as_bytes:
+                return self.serializer.dumps_bytes(output)
+            return self.serializer.dumps(output)
         return output
 
-    def create_batch(self, count, export_json=False):
-        """Generate batch fake profile v2 objects."""
-        hierarchy = create_random_hierarchy_iter()
-        faker = IAMFaker(hierarchy=hierarchy)
-        batch = []
-        for _ in range(count):
-            obj = faker.create()
-            batch.append(obj)
-
+    def create_lazy(self, seed=None, index=0):
+        """Return a `LazyProfile` generating its fields on first access.
+
+        With a `seed` it is the same as `create(seed=seed, index=index)`.
+        Without one it gets a random seed and its dates are bounded by the
+        current time. It is generated by the faker of the current thread, so
+        it should not be shared between threads.
+        """
+        hierarchy = None
+        if seed is None:
+            seed, now = random.getrandbits(64), None
+        else:
+            hierarchy = create_random_hierarchy_iter(index, seed)
+            now = SEED_REFERENCE_TIME
+        return LazyProfile(self._faker(), seed=seed, index=index, hierarchy=hierarchy, now=now)
+
+    def iter_batch(self, count, workers=None, seed=None, engine='default', org=None, start=0):
+        """Lazily generate `count` fake profile v2 objects.
+
+        Generation begins at position `start` of the batch, a seeded batch can
+        be generated in several parts, for example to resume an interrupted one.
+
+        If `workers` is greater than 1 the profiles are generated in a pool of
+        worker processes. See `_iter_parallel_batch`.
+
+        The `bulk` engine draws the random values of blocks of profiles at
+        once and is several times faster, see `iam_profile_faker.bulk`. Its
+        profiles are not instrumented and cannot be regenerated one by one.
+        The `template` engine fills a precompiled skeleton of the serialized
+        profile with the values of the `bulk` engine, see
+        `iam_profile_faker.template`.
+
+        With an `OrgHierarchy` `org` the HRIS records of the profiles are
+        linked to their managers by the org tree, see `iam_profile_faker.hierarchy`.
+        """
+        if workers and workers > 1:
+            return self._iter_parallel_batch(count, workers, seed, engine=engine, org=org,
+                                             start=start)
+        return _iter_engine(engine, start, count, seed=seed,
+                            instrumentation=self.instrumentation, org=org)
+
+    def iter_encoded(self, count, workers=None, seed=None, engine='default', org=None,
+                     start=0):
+        """Lazily generate `count` fake profile v2 objects serialized to JSON bytes.
+
+        See `iter_batch`.
+
+        In parallel mode the profiles are serialized by the worker processes.
+        The `template` engine renders its profiles itself, formatted like the
+        stdlib serializer does whichever serializer is configured.
+        """
+        if workers and workers > 1:
+            return self._iter_parallel_batch(count, workers, seed,
+                                             serializer=self.serializer.name, engine=engine,
+                                             org=org, start=start)
+
+        return _iter_engine_encoded(engine, start, count, self.serializer.dumps_bytes,
+                                    seed=seed, instrumentation=self.instrumentation, org=org)
+
+    def _iter_parallel_batch(self, count, workers, seed=None, serializer=None,
+                             engine='default', org=None, start=0):
+        """Generate profiles in a process pool and yield them in order.
+
+        The batch is split into shards of `SHARD_SIZE` profiles, each covering
+        its own EmployeeID range. Every profile is derived from `seed` and its
+        position only, so the output is the same as in a single process. At
+        most two shards per worker are in flight to keep memory use bounded.
+        Workers rebuild the tree of `org` from its parameters.
+        """
+        if seed is None:
+            seed = random.getrandbits(64)
+
+        def shards():
+            # Shards are aligned on multiples of SHARD_SIZE whatever `start` is
+            position, stop = start, start + count
+            while position < stop:
+                end = min((position // SHARD_SIZE + 1) * SHARD_SIZE, stop)
+                yield (seed, position, end - position, serializer, engine, org)
+                position = end
+
+        pool = multiprocessing.Pool(workers)
+        try:
+            pending = collections.deque()
+            for shard in shards():
+                pending.append(pool.apply_async(_create_shard, (shard,)))
+                if len(pending) >= workers * 2:
+                    for obj in pending.popleft().get():
+                        yield obj
+            while pending:
+                for obj in pending.popleft().get():
+                    yield obj
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def create_batch(self, count, export_json=False, workers=None, seed=None,
+                     as_bytes=False, engine='default', org=None, compact=False):
+        """Generate batch fake profile v2 objects.
+
+        With `export_json` the batch is returned as a serialized JSON array,
+        as UTF-8 encoded bytes if `as_bytes` is set. With `compact` the
+        profiles are returned in the compact representation of
+        `iam_profile_faker.compact`, for batches kept in memory: ~50KB per
+        profile instead of ~91KB as generated dicts, see
+        benchmarks/bench_memory.py.
+        """
         if export_json:
-            return json.dumps(batch)
-        return batch
+            encoded = self.iter_encoded(count, workers=workers, seed=seed, engine=engine,
+                                        org=org)
+            output = b'[' + b', '.join(encoded) + b']'
+            return output if as_bytes else output.decode('utf-8')
+
+        profiles = self.iter_batch(count, workers=workers, seed=seed, engine=engine, org=org)
+        if compact:
+            return [to_compact(profile) for profile in profiles]
+        return list(profiles)
+
+    def write_batch(self, count, fp, ndjson=False, workers=None, seed=None, engine='default',
+                    org=None):
+        """Stream `count` fake profile v2 objects to the file-like object `fp`.
+
+        Profiles are serialized and written one by one so memory use does
+        not grow with `count`. `fp` should be opened in binary mode.
+        """
+        encoded = self.iter_encoded(count, workers=workers, seed=seed, engine=engine, org=org)
+        write_batch(encoded, fp, ndjson=ndjson)
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+"""GraphQL schema over the profile v2 shape, generating only the selected fields.
+
+Queries resolve to `LazyProfile` objects, so every top-level field of a
+profile is generated when a query selects it, along with the fields it
+depends on, and a query asking for `pronouns { value }` costs one field
+instead of a whole profile with ~40 signed envelopes. Fields are generated
+whole, with their metadata and signatures whether they are selected or not. Fields are generated
+with their own random stream derived from the profile seed, its position and
+the field name, so a seeded profile is the same as the one of
+`V2ProfileFactory.create(seed=seed, index=index)` whichever fields are
+selected. Field names are the snake_case names of the profile v2 schema::
+
+    {
+      profiles(count: 10, seed: 42) {
+        first_name { value }
+        primary_email { value }
+        staff_information { title { value metadata { display } } }
+      }
+    }
+"""
+import graphene
+from graphene.types.generic import GenericScalar
+
+from iam_profile_faker.bulk import STAFF_INFORMATION
+from iam_profile_faker.factory import ACCESS_PUBLISHERS, IDENTITIES, V2ProfileFactory
+
+# Largest number of profiles a query can request
+MAX_COUNT = 10000
+
+# Each thread of the server gets its own faker
+_factory = V2ProfileFactory()
+
+
+class Metadata(graphene.ObjectType):
+    classification = graphene.String()
+    display = graphene.String()
+    last_modified = graphene.String()
+    created = graphene.String()
+    verified = graphene.Boolean()
+
+
+class Publisher(graphene.ObjectType):
+    alg = graphene.String()
+    typ = graphene.String()
+    value = graphene.String()
+    name = graphene.String()
+
+
+class Signature(graphene.ObjectType):
+    publisher = graphene.Field(Publisher)
+    additional = graphene.List(Publisher)
+
+
+class StringAttribute(graphene.ObjectType):
+    value = graphene.String()
+    metadata = graphene.Field(Metadata)
+    signature = graphene.Field(Signature)
+
+
+class BooleanAttribute(graphene.ObjectType):
+    value = graphene.Boolean()
+    metadata = graphene.Field(Metadata)
+    signature = graphene.Field(Signature)
+
+
+class ValuesAttribute(graphene.ObjectType):
+    values = GenericScalar()
+    metadata = graphene.Field(Metadata)
+    signature = graphene.Field(Signature)
+
+
+def _field(type_, name):
+    """Return a field resolving to the top-level field `name` of the profile."""
+    return graphene.Field(type_, resolver=lambda root, info: root[name])
+
+
+def _group(name, fields):
+    """Return the object type `name` of a group of attributes.
+
+    `fields` is a list of (name, attribute type) pairs, the group is the dict
+    of a top-level field of the profile.
+    """
+    return type(name, (graphene.ObjectType,), dict(
+        (field, graphene.Field(type_)) for field, type_ in fields))
+
+
+class Profile(graphene.ObjectType):
+    access_information = _field(_group('Access_Information', [
+        (publisher, ValuesAttribute)
+        for publisher in [name for name, _ in ACCESS_PUBLISHERS] + ['hris']]),
+        'access_information')
+    active = _field(BooleanAttribute, 'active')
+    alternative_name = _field(StringAttribute, 'alternative_name')
+    created = _field(StringAttribute, 'created')
+    description = _field(StringAttribute, 'description')
+    first_name = _field(StringAttribute, 'first_name')
+    fun_title = _field(StringAttribute, 'fun_title')
+    identities = _field(_group('Identities', [(name, StringAttribute) for name, _ in IDENTITIES]),
+                        'identities')
+    languages = _field(ValuesAttribute, 'languages')
+    last_modified = _field(StringAttribute, 'last_modified')
+    last_name = _field(StringAttribute, 'last_name')
+    location = _field(StringAttribute, 'location')
+    login_method = _field(StringAttribute, 'login_method')
+    pgp_public_keys = _field(ValuesAttribute, 'pgp_public_keys')
+    phone_numbers = _field(ValuesAttribute, 'phone_numbers')
+    picture = _field(StringAttribute, 'picture')
+    primary_email = _field(StringAttribute, 'primary_email')
+    pronouns = _field(StringAttribute, 'pronouns')
+    schema = _field(graphene.String, 'schema')
+    ssh_public_keys = _field(ValuesAttribute, 'ssh_public_keys')
+    staff_information = _field(_group('Staff_Information', [
+        (name, BooleanAttribute if field in (None, 'IsManager', 'isDirectorOrAbove')
+         else StringAttribute)
+        for name, field, _, _ in STAFF_INFORMATION]), 'staff_information')
+    tags = _field(ValuesAttribute, 'tags')
+    timezone = _field(StringAttribute, 'timezone')
+    uris = _field(ValuesAttribute, 'uris')
+    user_id = _field(StringAttribute, 'user_id')
+    usernames = _field(ValuesAttribute, 'usernames')
+
+
+class Query(graphene.ObjectType):
+    profile = graphene.Field(Profile, seed=graphene.Int(), index=graphene.Int(default_value=0),
+                             description='A single profile, the index-th one of the seed.')
+    profiles = graphene.List(Profile, count=graphene.Int(default_value=10), seed=graphene.Int(),
+                             description='A batch of profiles, reproducible with a seed.')
+
+    def resolve_profile(root, info, seed=None, index=0):
+        return _factory.create_lazy(seed, index)
+
+    def resolve_profiles(root, info, count=10, seed=None):
+        if not 1 <= count <= MAX_COUNT:
+            raise ValueError('count must be between 1 and {0}'.format(MAX_COUNT))
+        return [_factory.create_lazy(seed, index) for index in range(count)]
+
+
+schema = graphene.Schema(query=Query, auto_camelcase=False)
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+"""Org hierarchies linking the HRIS records of a batch to their managers.
+
+`create_random_hierarchy_iter` picks the manager of every employee uniformly
+among the previous ones, which makes trees that get deeper and flatter than
+any real organization as the batch grows, and leaves the manager name and
+email of the HRIS records unrelated to the manager's own profile.
+
+`OrgHierarchy` instead builds the whole tree of an organization of `size`
+employees up front, breadth first from the top: every manager gets a number
+of direct reports drawn from a span of control distribution and every report
+becomes a manager in turn with probability `manager_ratio`, unless it is at
+`max_depth`. EmployeeIDs are assigned in that order, so managers always come
+before their reports, and the tree is stored as flat arrays indexed by
+EmployeeID for O(1) lookups.
+
+The tree, and the name and email of every employee, only depend on the
+parameters of the hierarchy and its seed. Worker processes rebuild the same
+tree from them, only the parameters are pickled.
+"""
+import collections
+import random
+from array import array
+
+from iam_profile_faker.factory import MANAGEMENT_LEVELS, derive_seed
+from iam_profile_faker.vocabulary import get_vocabulary
+
+# Minimum, most likely and maximum number of direct reports of a manager
+SPAN_OF_CONTROL = (2, 6, 12)
+
+# Domain of the work email addresses
+DOMAIN = 'example.com'
+
+# Trees built in this process, only the last one is kept
+_trees = {}
+
+Person = collections.namedtuple('Person', ['first_name', 'last_name', 'name', 'email'])
+
+
+def _build_tree(size, seed, span, max_depth, manager_ratio):
+    """Return the manager, depth and number of reports arrays of a tree."""
+    rng = random.Random(derive_seed(seed, 0, 'org'))
+    rand = rng.random
+    low, mode, high = span
+
+    # Indexed by EmployeeID, 0 is the manager of the top of the tree
+    managers = array('I', [0]) * (size + 1)
+    depths = array('H', [0]) * (size + 1)
+    reports = array('I', [0]) * (size + 1)
+
+    pending = collections.deque([1] if size else [])
+    next_id = 2
+    while next_id <= size:
+        if not pending:
+            # Every manager got its reports, promote individual contributors
+            pending.extend(employee for employee in range(2, next_id)
+                           if not reports[employee] and
+                           (max_depth is None or depths[employee] < max_depth))
+            if not pending:
+                raise ValueError('{0} employees do not fit within a depth of {1}'.format(
+                    size, max_depth))
+
+        manager = pending.popleft()
+        count = min(int(rng.triangular(low, high, mode) + 0.5), size - next_id + 1)
+        end = next_id + count
+        depth = depths[manager] + 1
+        managers[next_id:end] = array('I', [manager]) * count
+        depths[next_id:end] = array('H', [depth]) * count
+        reports[manager] = count
+        if max_depth is None or depth < max_depth:
+            pending.extend(employee for employee in range(next_id, end)
+                           if rand() < manager_ratio)
+        next_id = end
+
+    return managers, depths, reports
+
+
+class OrgHierarchy(object):
+    """Org tree of `size` employees, EmployeeIDs 1 to `size`.
+
+    `span` is the (minimum, mode, maximum) of the triangular distribution of
+    the number of direct reports of a manager, `max_depth` the maximum number
+    of levels under the top of the tree. Managers at a depth lower than
+    `director_depth` are directors or above. Without a seed the tree is
+    random but still the same in every worker process.
+    """
+
+    def __init__(self, size, seed=None, span=SPAN_OF_CONTROL, max_depth=None,
+                 manager_ratio=0.9, director_depth=3, locale=None, domain=DOMAIN):
+        low, mode, high = span
+        if not 1 <= low <= mode <= high:
+            raise ValueError('Invalid span of control {0}'.format(span))
+        if max_depth is not None and max_depth < 1 < size:
+            raise ValueError('max_depth needs to be > 0')
+
+        self.size = size
+        self.seed = seed if seed is not None else random.getrandbits(64)
+        self.span = tuple(span)
+        self.max_depth = max_depth
+        self.manager_ratio = manager_ratio
+        self.director_depth = director_depth
+        self.locale = locale
+        self.domain = domain
+        self._load()
+
+    def _load(self):
+        key = (self.size, self.seed, self.span, self.max_depth, self.manager_ratio)
+        try:
+            tree = _trees[key]
+        except KeyError:
+            tree = _build_tree(*key)
+            _trees.clear()
+            _trees[key] = tree
+        self.managers, self.depths, self.reports = tree
+        self.vocabulary = get_vocabulary(self.locale)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ('managers', 'depths', 'reports', 'vocabulary'):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._load()
+
+    def __len__(self):
+        return self.size
+
+    def manager(self, employee_id):
+        """Return the EmployeeID of the manager of `employee_id`, 0 for the top of the tree."""
+        return self.managers[employee_id]
+
+    def depth(self, employee_id):
+        """Return the number of managers above `employee_id`."""
+        return self.depths[employee_id]
+
+    def direct_reports(self, employee_id):
+        """Return the number of direct reports of `employee_id`."""
+        return self.reports[employee_id]
+
+    def person(self, employee_id):
+        """Return the name and work email of `employee_id`, see `Person`."""
+        rng = random.Random(derive_seed(self.seed, employee_id, 'person'))
+        first_name = self.vocabulary.choice('first_name', rng)
+        last_name = self.vocabulary.choice('last_name', rng)
+        # The EmployeeID keeps the addresses unique
+        email = '{0}.{1}{2}@{3}'.format(first_name, last_name, employee_id, self.domain)
+        return Person(first_name, last_name, '{0} {1}'.format(first_name, last_name),
+                      email.lower().replace(' ', '').replace("'", ''))
+
+    def positions(self, start=0, count=None):
+        """Return an iterator of (EmployeeID, manager EmployeeID) pairs from position `start`.
+
+        It has the same interface as `create_random_hierarchy_iter`, the
+        range of positions has to be within the tree.
+        """
+        if start < 0 or start + (count or 0) > self.size:
+            raise ValueError('Positions {0} to {1} are outside of an org of {2} employees'.format(
+                start, start + (count or 0), self.size))
+        return OrgPositions(self, start)
+
+    def update_hris(self, values):
+        """Make the HRIS `values` of an employee match its position in the tree."""
+        employee_id = values['EmployeeID']
+        person = self.person(employee_id)
+        values.update({
+            'LastName': person.last_name,
+            'Preferred_Name': person.name,
+            'PreferredFirstName': person.first_name,
+            'LegalFirstName': person.first_name,
+            'primary_work_email': person.email,
+            'IsManager': self.reports[employee_id] > 0,
+            'isDirectorOrAbove': (self.reports[employee_id] > 0 and
+                                  self.depths[employee_id] < self.director_depth),
+            'Management_Level': '',
+            'WorkersManager': 'unknown',
+            'Worker_s_Manager_s_Email_Address': '',
+        })
+        if values['IsManager']:
+            # Higher levels of management closer to the top of the tree
+            level = self.director_depth + 1 - self.depths[employee_id]
+            level = min(len(MANAGEMENT_LEVELS) - 1, max(0, level))
+            values['Management_Level'] = '{} Manager'.format(MANAGEMENT_LEVELS[level])
+
+        manager_id = self.managers[employee_id]
+        if manager_id:
+            manager = self.person(manager_id)
+            values['WorkersManager'] = manager.name
+            values['Worker_s_Manager_s_Email_Address'] = manager.email
+
+
+class OrgPositions(object):
+    """Iterator of the positions of an `OrgHierarchy`, see `OrgHierarchy.positions`."""
+
+    def __init__(self, org, start=0):
+        self.org = org
+        self.position = start
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        employee_id = self.position + 1
+        if employee_id > self.org.size:
+            raise ValueError('Employee {0} is outside of an org of {1} employees'.format(
+                employee_id, self.org.size))
+        self.position = employee_id
+        return employee_id, self.org.managers[employee_id]
+
+    next = __next__
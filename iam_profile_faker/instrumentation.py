@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+"""Opt-in timing instrumentation of the profile generators."""
+import collections
+import threading
+import timeit
+
+
+class Instrumentation(object):
+    """Cumulative wall time and call counts per generator.
+
+    Times are inclusive: `create` contains the time of all the generators it
+    calls and `access_information` the time of `hris`.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = collections.defaultdict(int)
+        self.seconds = collections.defaultdict(float)
+
+    def record(self, name, seconds):
+        """Record a call to `name` that took `seconds`."""
+        with self.lock:
+            self.calls[name] += 1
+            self.seconds[name] += seconds
+
+    def wrap(self, name, function):
+        """Return `function` wrapped to record its calls under `name`."""
+        timer = timeit.default_timer
+
+        def wrapper(*args, **kwargs):
+            start = timer()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.record(name, timer() - start)
+        return wrapper
+
+    def reset(self):
+        with self.lock:
+            self.calls.clear()
+            self.seconds.clear()
+
+    def snapshot(self):
+        """Return a {name: (calls, seconds)} copy of the counters."""
+        with self.lock:
+            return dict((name, (self.calls[name], self.seconds[name])) for name in self.calls)
+
+    def report(self):
+        """Return the counters as a text table, most expensive first."""
+        lines = ['{0:<28} {1:>10} {2:>12} {3:>12}'.format(
+            'generator', 'calls', 'total (s)', 'mean (us)')]
+        stats = sorted(self.snapshot().items(), key=lambda item: item[1][1], reverse=True)
+        for name, (calls, seconds) in stats:
+            lines.append('{0:<28} {1:>10} {2:>12.4f} {3:>12.1f}'.format(
+                name, calls, seconds, seconds / calls * 1e6))
+        return '\n'.join(lines) + '\n'
+
+    def prometheus(self, prefix='iam_profile_faker_generator'):
+        """Return the counters in the Prometheus text exposition format."""
+        stats = sorted(self.snapshot().items())
+        lines = [
+            '# HELP {0}_calls_total Number of calls of the generator.'.format(prefix),
+            '# TYPE {0}_calls_total counter'.format(prefix),
+        ]
+        for name, (calls, _) in stats:
+            lines.append('{0}_calls_total{{generator="{1}"}} {2}'.format(prefix, name, calls))
+        lines += [
+            '# HELP {0}_seconds_total Time spent in the generator.'.format(prefix),
+            '# TYPE {0}_seconds_total counter'.format(prefix),
+        ]
+        for name, (_, seconds) in stats:
+            lines.append('{0}_seconds_total{{generator="{1}"}} {2!r}'.format(
+                prefix, name, seconds))
+        return '\n'.join(lines) + '\n'
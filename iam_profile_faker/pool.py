@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+"""Pool of pre-generated, pre-serialized profiles refilled in the background."""
+import collections
+import os
+import threading
+
+from concurrent.futures import ProcessPoolExecutor
+
+from iam_profile_faker.factory import IAMFaker
+from iam_profile_faker.serializers import get_serializer
+
+
+def _create_serialized(count):
+    """Generate `count` profiles serialized to JSON bytes."""
+    faker = IAMFaker()
+    dumps_bytes = get_serializer().dumps_bytes
+    return [dumps_bytes(faker.create()) for _ in range(count)]
+
+
+class ProfilePool(object):
+    """Bounded buffer of profiles serialized to JSON bytes, kept full by a background thread.
+
+    Whenever the number of buffered profiles drops to `low_water` the refill
+    thread generates profiles until the buffer holds `size` of them again, in
+    chunks of `chunk_size`. With `refill_workers` > 0 the chunks are generated
+    in that many worker processes, otherwise in the refill thread itself.
+    When the buffer is empty profiles are generated on the spot and counted as
+    misses.
+
+    Profiles are generated independently, like the ones of `/user`, so the
+    HRIS hierarchy of a batch taken from the pool is not consistent.
+    """
+
+    def __init__(self, size=1000, low_water=None, refill_workers=0, chunk_size=50):
+        self.size = size
+        self.low_water = size // 2 if low_water is None else low_water
+        self.refill_workers = refill_workers
+        self.chunk_size = chunk_size
+        self.buffer = collections.deque(maxlen=size)
+        self.hits = 0
+        self.misses = 0
+        self.condition = threading.Condition()
+        self._pid = None
+
+    def _ensure_started(self):
+        # The refill thread is started on first use, and again in forked
+        # server workers, since threads do not survive a fork
+        if self._pid == os.getpid():
+            return
+        with self.condition:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.buffer.clear()
+            thread = threading.Thread(target=self._refill, name='profile-pool-refill')
+            thread.daemon = True
+            thread.start()
+
+    def _refill(self):
+        executor = None
+        if self.refill_workers > 0:
+            executor = ProcessPoolExecutor(self.refill_workers)
+        while True:
+            with self.condition:
+                while len(self.buffer) > self.low_water:
+                    self.condition.wait()
+                missing = self.size - len(self.buffer)
+
+            chunks = [self.chunk_size] * (missing // self.chunk_size)
+            if missing % self.chunk_size:
+                chunks.append(missing % self.chunk_size)
+            if executor:
+                results = executor.map(_create_serialized, chunks)
+            else:
+                results = (_create_serialized(chunk) for chunk in chunks)
+            for profiles in results:
+                self.buffer.extend(profiles)
+
+    def pop(self):
+        """Return one profile serialized to JSON bytes."""
+        return self.pop_many(1)[0]
+
+    def pop_many(self, count):
+        """Return a list of `count` profiles serialized to JSON bytes."""
+        self._ensure_started()
+        profiles = []
+        for _ in range(count):
+            try:
+                profiles.append(self.buffer.popleft())
+            except IndexError:
+                break
+
+        with self.condition:
+            self.hits += len(profiles)
+            self.misses += count - len(profiles)
+            if len(self.buffer) <= self.low_water:
+                self.condition.notify()
+
+        if len(profiles) < count:
+            profiles.extend(_create_serialized(count - len(profiles)))
+        return profiles
+
+    def stats(self):
+        """Return the buffer occupancy and hit/miss counters."""
+        return {
+            'size': self.size,
+            'low_water': self.low_water,
+            'refill_workers': self.refill_workers,
+            'available': len(self.buffer),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
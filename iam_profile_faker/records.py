@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+"""Compact binary export format with random access to single profiles.
+
+A record file is laid out as follows, all integers being little endian::
+
+    header   MAGIC VERSION
+    records  (uint32 length, zlib compressed profile JSON) * count
+    offsets  uint64 offset of every record * count
+    keys     zlib compressed JSON list of [user_id, primary_email, EmployeeID]
+    trailer  uint64 count, uint64 offsets position, uint64 keys position, MAGIC
+
+Readers map the file in memory and only decode the trailer and the offsets
+when opened, so profile `i` is read without touching the other records. The
+keys are decoded on the first lookup by user_id, email or EmployeeID.
+"""
+import array
+import json
+import mmap
+import struct
+import sys
+import zlib
+
+from iam_profile_faker.serializers import get_serializer
+from iam_profile_faker.store import profile_keys
+
+MAGIC = b'IPFR'
+VERSION = 1
+HEADER = struct.Struct('<4sB')
+LENGTH = struct.Struct('<I')
+TRAILER = struct.Struct('<QQQ4s')
+
+
+def _offsets_array(data=None):
+    offsets = array.array('Q')
+    if data is not None:
+        offsets.frombytes(data)
+        if sys.byteorder == 'big':
+            offsets.byteswap()
+    return offsets
+
+
+class RecordWriter(object):
+    """Append profiles to a binary file object in the record format.
+
+    Only the offsets and the lookup keys of the profiles are kept in memory.
+    `close` writes the index and has to be called once all the profiles are
+    added.
+    """
+
+    def __init__(self, fp, level=6, serializer=None):
+        self.fp = fp
+        self.level = level
+        self.serializer = get_serializer(serializer)
+        self.offsets = _offsets_array()
+        self.keys = []
+        self.fp.write(HEADER.pack(MAGIC, VERSION))
+        self.position = HEADER.size
+
+    def add(self, profile):
+        """Append a single profile."""
+        data = zlib.compress(self.serializer.dumps_bytes(profile), self.level)
+        self.offsets.append(self.position)
+        self.keys.append(profile_keys(profile))
+        self.fp.write(LENGTH.pack(len(data)))
+        self.fp.write(data)
+        self.position += LENGTH.size + len(data)
+
+    def close(self):
+        """Write the index footer."""
+        offsets_position = self.position
+        offsets = array.array('Q', self.offsets)
+        if sys.byteorder == 'big':
+            offsets.byteswap()
+        self.fp.write(offsets.tobytes())
+
+        keys_position = offsets_position + len(self.offsets) * 8
+        self.fp.write(zlib.compress(json.dumps(self.keys).encode('utf-8'), self.level))
+        self.fp.write(TRAILER.pack(len(self.offsets), offsets_position, keys_position, MAGIC))
+        self.fp.flush()
+
+
+def write_records(profiles, fp, level=6, serializer=None):
+    """Write `profiles` to the binary file object `fp` in the record format."""
+    writer = RecordWriter(fp, level=level, serializer=serializer)
+    for profile in profiles:
+        writer.add(profile)
+    writer.close()
+    return len(writer.offsets)
+
+
+class RecordFileStore(object):
+    """Read only profile store serving profiles straight from a record file."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version = HEADER.unpack_from(self.data, 0)
+        count, offsets_position, keys_position, trailer_magic = TRAILER.unpack_from(
+            self.data, len(self.data) - TRAILER.size)
+        if magic != MAGIC or trailer_magic != MAGIC or version != VERSION:
+            raise ValueError('{0} is not a profile record file.'.format(path))
+
+        self.count = count
+        self.offsets = _offsets_array(self.data[offsets_position:keys_position])
+        self._keys_position = keys_position
+        self._indexes = None
+
+    def _indexes_for_keys(self):
+        if self._indexes is None:
+            compressed = self.data[self._keys_position:len(self.data) - TRAILER.size]
+            indexes = ({}, {}, {})
+            for position, keys in enumerate(json.loads(zlib.decompress(compressed))):
+                for index, key in zip(indexes, keys):
+                    index.setdefault(key, position)
+            self._indexes = indexes
+        return self._indexes
+
+    def read(self, position):
+        """Return the JSON bytes of the profile at `position`."""
+        offset = self.offsets[position]
+        length, = LENGTH.unpack_from(self.data, offset)
+        start = offset + LENGTH.size
+        return zlib.decompress(self.data[start:start + length])
+
+    def __getitem__(self, position):
+        if not 0 <= position < self.count:
+            raise IndexError(position)
+        return json.loads(self.read(position))
+
+    def _find(self, key, value):
+        position = self._indexes_for_keys()[key].get(value)
+        return None if position is None else self[position]
+
+    def all(self):
+        """Return all the profiles of the store."""
+        return [self[position] for position in range(self.count)]
+
+    def get(self, user_id):
+        """Return the profile with id `user_id` or None."""
+        return self._find(0, user_id)
+
+    def get_by_email(self, primary_email):
+        """Return the profile with `primary_email` or None."""
+        return self._find(1, primary_email)
+
+    def get_by_employee_id(self, employee_id):
+        """Return the profile with HRIS `employee_id` or None."""
+        return self._find(2, employee_id)
+
+    def page(self, after=0, limit=None):
+        """Yield (cursor, profile JSON) pairs of the profiles after `after`.
+
+        The cursor of a profile is its position in the file, starting at 1.
+        """
+        stop = self.count if limit is None else min(self.count, after + limit)
+        for position in range(after, stop):
+            yield position + 1, self.read(position).decode('utf-8')
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self.data.close()
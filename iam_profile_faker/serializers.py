@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+"""JSON serializers for profile v2 objects.
+
+The stdlib `json` module is used by default. `orjson`, installed with the
+`fast` extra, encodes straight to UTF-8 bytes several times faster but
+produces compact output, without spaces after separators, so it is only used
+when requested: IAM_PROFILE_FAKER_JSON=orjson, or IAM_PROFILE_FAKER_JSON=auto
+for the fastest installed backend.
+"""
+import functools
+import json
+import os
+from collections.abc import Mapping
+
+from iam_profile_faker.compact import CompactObject
+
+
+def _default(obj):
+    # Compact profiles are converted in one go, other mappings, like lazy
+    # profiles, are serialized as dicts
+    if isinstance(obj, CompactObject):
+        return obj.to_dict()
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    raise TypeError('Object of type {0} is not JSON serializable'.format(
+        obj.__class__.__name__))
+
+
+# Same output as `json.dumps`
+_encoder = json.JSONEncoder(default=_default)
+
+
+class JSONSerializer(object):
+    """Serializer based on the stdlib `json` module."""
+
+    name = 'json'
+
+    def dumps(self, obj):
+        """Serialize `obj` to a JSON string."""
+        return _encoder.encode(obj)
+
+    def dumps_bytes(self, obj):
+        """Serialize `obj` to UTF-8 encoded JSON bytes."""
+        return _encoder.encode(obj).encode('utf-8')
+
+
+class OrjsonSerializer(object):
+    """Serializer based on `orjson`."""
+
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self.dumps_bytes = functools.partial(orjson.dumps, default=_default)
+
+    def dumps(self, obj):
+        """Serialize `obj` to a JSON string."""
+        return self.dumps_bytes(obj).decode('utf-8')
+
+
+SERIALIZERS = {
+    'json': JSONSerializer,
+    'orjson': OrjsonSerializer,
+}
+
+# Backends tried in order by 'auto'
+PREFERRED = ['orjson', 'json']
+
+
+def get_serializer(name=None):
+    """Return the serializer `name`, 'auto' for the fastest installed one.
+
+    Defaults to IAM_PROFILE_FAKER_JSON, or the stdlib `json` one, which keeps
+    its output formatting.
+    """
+    name = name or os.environ.get('IAM_PROFILE_FAKER_JSON', 'json')
+    if name != 'auto':
+        return SERIALIZERS[name]()
+
+    for name in PREFERRED:
+        try:
+            return SERIALIZERS[name]()
+        except ImportError:
+            continue
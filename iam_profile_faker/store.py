@@ -0,0 +1,415 @@
+# -*- coding: utf-8 -*-
+
+"""Persistent stores for fake profile v2 objects."""
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from tinydb import TinyDB
+
+from iam_profile_faker.compact import to_compact
+
+# Number of profiles inserted in one transaction by `insert_chunks`, a profile
+# takes ~90KB of memory as nested dicts
+CHUNK_SIZE = 1000
+
+STORE_EXTENSIONS = {
+    'records': '.ipf',
+    'sqlite': '.sqlite3',
+    'tinydb': '.json',
+}
+
+
+def profile_keys(profile):
+    """Return the (user_id, primary_email, EmployeeID) lookup keys of a profile."""
+    hris = profile.get('access_information', {}).get('hris', {}).get('values') or {}
+    return (
+        profile.get('user_id', {}).get('value'),
+        profile.get('primary_email', {}).get('value'),
+        hris.get('EmployeeID'),
+    )
+
+
+def project_profile(profile, fields):
+    """Return a copy of `profile` restricted to `fields`.
+
+    Fields are top level attribute names or dotted paths to nested ones, for
+    example `staff_information.title`. Unknown fields are ignored.
+    """
+    projection = {}
+    for field in fields:
+        path = field.split('.')
+        source = profile
+        for name in path:
+            if not isinstance(source, dict) or name not in source:
+                break
+            source = source[name]
+        else:
+            target = projection
+            for name in path[:-1]:
+                target = target.setdefault(name, {})
+            target[path[-1]] = source
+    return projection
+
+
+def int_argument(args, name, minimum):
+    """Return argument `name` of the query string `args` as an int, None if it is missing.
+
+    Raise ValueError, with a message meant for the client, if it is not an
+    integer >= `minimum`.
+    """
+    value = args.get(name)
+    if value is None:
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        value = None
+    if value is None or value < minimum:
+        raise ValueError('{0} must be an integer >= {1}'.format(name, minimum))
+    return value
+
+
+def page_arguments(args):
+    """Return the (cursor, limit, fields) of a page of profiles from the query string `args`.
+
+    * `limit`: maximum number of profiles to return
+    * `cursor`: return the profiles after this cursor
+    * `fields`: comma separated list of (dotted) fields to return
+
+    Raise ValueError like `int_argument`.
+    """
+    limit = int_argument(args, 'limit', 1)
+    cursor = int_argument(args, 'cursor', 0) or 0
+    fields = [field for field in args.get('fields', '').split(',') if field]
+    return cursor, limit, fields
+
+
+def page_profiles(store, cursor=0, limit=None, fields=None):
+    """Return the profiles of `store` after `cursor` and the cursor of the next page.
+
+    The profiles are an iterator of JSON strings, restricted to `fields` if
+    any, see `project_profile`. The next cursor is None if there are no more
+    profiles than `limit`.
+    """
+    rows = store.page(after=cursor, limit=limit + 1 if limit is not None else None)
+    next_cursor = None
+    if limit is not None:
+        rows = list(rows)
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = rows[-1][0]
+
+    items = (profile for _, profile in rows)
+    if fields:
+        items = (json.dumps(project_profile(json.loads(profile), fields))
+                 for profile in items)
+    return items, next_cursor
+
+
+def locate_store(directory):
+    """Return the path of the profile store in `directory`, None if there is none.
+
+    SQLite stores are preferred over record files, and both over TinyDB ones.
+    """
+    files = sorted(os.listdir(directory))
+    for backend in ('sqlite', 'records', 'tinydb'):
+        extension = STORE_EXTENSIONS[backend]
+        for file in files:
+            if file.endswith(extension):
+                return os.path.join(directory, file)
+    return None
+
+
+def insert_chunks(store, profiles, chunk_size=CHUNK_SIZE):
+    """Insert the profiles of the iterable `profiles` in `store`, `chunk_size` at a time.
+
+    Only one chunk of profiles is held in memory. `SQLiteStore` inserts every
+    chunk in its own transaction, so an interrupted load keeps the chunks it
+    inserted. Yield the number of profiles inserted so far after every chunk.
+    """
+    profiles = iter(profiles)
+    inserted = 0
+    while True:
+        chunk = list(itertools.islice(profiles, chunk_size))
+        if not chunk:
+            return
+        store.insert_many(chunk)
+        inserted += len(chunk)
+        # Released before the next chunk is generated
+        del chunk
+        yield inserted
+
+
+class TinyDBStore(object):
+    """Profile store backed by a TinyDB JSON file.
+
+    Every lookup parses the whole file and every insert rewrites it, prefer
+    `SQLiteStore` for anything but small databases.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def insert_many(self, profiles):
+        """Insert profiles in the store."""
+        TinyDB(self.path).insert_multiple(profiles)
+
+    def all(self):
+        """Return all the profiles of the store."""
+        return TinyDB(self.path).all()
+
+    def _find(self, key, value):
+        for profile in self.all():
+            if profile_keys(profile)[key] == value:
+                return profile
+        return None
+
+    def get(self, user_id):
+        """Return the profile with id `user_id` or None."""
+        return self._find(0, user_id)
+
+    def get_by_email(self, primary_email):
+        """Return the profile with `primary_email` or None."""
+        return self._find(1, primary_email)
+
+    def get_by_employee_id(self, employee_id):
+        """Return the profile with HRIS `employee_id` or None."""
+        return self._find(2, employee_id)
+
+    def page(self, after=0, limit=None):
+        """Yield (cursor, profile JSON) pairs of the profiles after `after`."""
+        profiles = self.all()[after:]
+        for position, profile in enumerate(profiles[:limit], after + 1):
+            yield position, json.dumps(profile)
+
+    def __len__(self):
+        return len(TinyDB(self.path))
+
+
+class MemoryStore(object):
+    """Read only profile store held in memory with dict indexes on the lookup keys.
+
+    Profiles are held in the compact representation of
+    `iam_profile_faker.compact` and converted back to dicts when returned.
+    """
+
+    def __init__(self, profiles):
+        self.profiles = []
+        self.indexes = ({}, {}, {})
+        for profile in profiles:
+            keys = profile_keys(profile)
+            profile = to_compact(profile)
+            self.profiles.append(profile)
+            for index, key in zip(self.indexes, keys):
+                index.setdefault(key, profile)
+
+    def all(self):
+        """Return all the profiles of the store."""
+        return [profile.to_dict() for profile in self.profiles]
+
+    def _find(self, key, value):
+        profile = self.indexes[key].get(value)
+        return profile.to_dict() if profile is not None else None
+
+    def get(self, user_id):
+        """Return the profile with id `user_id` or None."""
+        return self._find(0, user_id)
+
+    def get_by_email(self, primary_email):
+        """Return the profile with `primary_email` or None."""
+        return self._find(1, primary_email)
+
+    def get_by_employee_id(self, employee_id):
+        """Return the profile with HRIS `employee_id` or None."""
+        return self._find(2, employee_id)
+
+    def page(self, after=0, limit=None):
+        """Yield (cursor, profile JSON) pairs of the profiles after `after`.
+
+        The cursor of a profile is its position in the store, starting at 1.
+        """
+        stop = len(self.profiles) if limit is None else after + limit
+        for position in range(after, min(stop, len(self.profiles))):
+            yield position + 1, json.dumps(self.profiles[position].to_dict())
+
+    def __len__(self):
+        return len(self.profiles)
+
+
+class SQLiteStore(object):
+    """Profile store backed by SQLite with indexes on the lookup keys.
+
+    Profiles are kept as JSON text next to indexed user_id, primary_email and
+    EmployeeID columns, so single profile lookups are O(log N). With
+    `in_memory` the database file is copied in memory once and the file is
+    not touched afterwards. The connection can be shared between threads.
+    """
+
+    SCHEMA = [
+        'CREATE TABLE IF NOT EXISTS profiles ('
+        ' id INTEGER PRIMARY KEY,'
+        ' user_id TEXT,'
+        ' primary_email TEXT,'
+        ' employee_id INTEGER,'
+        ' profile TEXT NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS profiles_user_id ON profiles (user_id)',
+        'CREATE INDEX IF NOT EXISTS profiles_primary_email ON profiles (primary_email)',
+        'CREATE INDEX IF NOT EXISTS profiles_employee_id ON profiles (employee_id)',
+    ]
+
+    def __init__(self, path, in_memory=False):
+        self.path = path
+        self.lock = threading.Lock()
+        if in_memory:
+            self.connection = sqlite3.connect(':memory:', check_same_thread=False)
+            source = sqlite3.connect(path)
+            source.backup(self.connection)
+            source.close()
+        else:
+            self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            for statement in self.SCHEMA:
+                self.connection.execute(statement)
+
+    def _execute(self, query, parameters=()):
+        with self.lock:
+            return self.connection.execute(query, parameters).fetchall()
+
+    def insert_many(self, profiles):
+        """Insert profiles in the store in a single transaction."""
+        rows = (profile_keys(profile) + (json.dumps(profile),) for profile in profiles)
+        with self.lock, self.connection:
+            self.connection.executemany(
+                'INSERT INTO profiles (user_id, primary_email, employee_id, profile) '
+                'VALUES (?, ?, ?, ?)', rows)
+
+    def all(self):
+        """Return all the profiles of the store."""
+        rows = self._execute('SELECT profile FROM profiles ORDER BY id')
+        return [json.loads(row[0]) for row in rows]
+
+    def _find(self, column, value):
+        rows = self._execute(
+            'SELECT profile FROM profiles WHERE {0} = ? ORDER BY id LIMIT 1'.format(column),
+            (value,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def get(self, user_id):
+        """Return the profile with id `user_id` or None."""
+        return self._find('user_id', user_id)
+
+    def get_by_email(self, primary_email):
+        """Return the profile with `primary_email` or None."""
+        return self._find('primary_email', primary_email)
+
+    def get_by_employee_id(self, employee_id):
+        """Return the profile with HRIS `employee_id` or None."""
+        return self._find('employee_id', employee_id)
+
+    def page(self, after=0, limit=None, fetch_size=500):
+        """Yield (cursor, profile JSON) pairs of the profiles after `after`.
+
+        The cursor of a profile is its row id. Rows are fetched `fetch_size`
+        at a time so the connection is never locked for a whole page and the
+        stored JSON is returned as is.
+        """
+        remaining = limit
+        while remaining is None or remaining > 0:
+            size = fetch_size if remaining is None else min(fetch_size, remaining)
+            rows = self._execute(
+                'SELECT id, profile FROM profiles WHERE id > ? ORDER BY id LIMIT ?',
+                (after, size))
+            for row in rows:
+                yield row
+            if len(rows) < size:
+                return
+            after = rows[-1][0]
+            if remaining is not None:
+                remaining -= len(rows)
+
+    def __len__(self):
+        return self._execute('SELECT COUNT(*) FROM profiles')[0][0]
+
+    def close(self):
+        self.connection.close()
+
+
+def open_store(path, in_memory=False):
+    """Open the profile store at `path`, the backend is picked by file extension.
+
+    With `in_memory` the store is loaded in memory once and served from there.
+    Record files are read only and always memory mapped.
+    """
+    if path.endswith(STORE_EXTENSIONS['records']):
+        from iam_profile_faker.records import RecordFileStore
+        return RecordFileStore(path)
+    if path.endswith(STORE_EXTENSIONS['tinydb']):
+        store = TinyDBStore(path)
+        return MemoryStore(store.all()) if in_memory else store
+    return SQLiteStore(path, in_memory=in_memory)
+
+
+class CachedStore(object):
+    """Keep an in-memory copy of the profile store located by `locate`.
+
+    The store is loaded on first use. Afterwards the file is stat'ed at most
+    once every `check_interval` seconds and reloaded only if its mtime or
+    inode changed. A `check_interval` of None disables the checks, so the
+    store only changes on an explicit `reload`.
+    """
+
+    def __init__(self, locate, check_interval=5):
+        self.locate = locate
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.path = None
+        self.store = None
+        self._signature = None
+        self._checked_at = 0
+
+    def _stat(self):
+        stat = os.stat(self.path)
+        return (stat.st_mtime, stat.st_ino)
+
+    def reload(self):
+        """Locate the store again and load it in memory."""
+        with self.lock:
+            self.path = self.locate()
+            if self.path is None:
+                raise LookupError('No profile store found.')
+            self._signature = self._stat()
+            self._checked_at = time.time()
+            # The previous store is not closed, requests may still be reading
+            # it: its connection or memory map is released along with it once
+            # the last of them drops it
+            self.store = open_store(self.path, in_memory=True)
+            return self.store
+
+    def stale(self):
+        """Return True if the store is not loaded yet or the file changed.
+
+        The file is only stat'ed if `check_interval` elapsed since the last
+        check, the store is not loaded.
+        """
+        if self.store is None:
+            return True
+        if self.check_interval is None:
+            return False
+        now = time.time()
+        if now - self._checked_at < self.check_interval:
+            return False
+        self._checked_at = now
+        try:
+            return self._stat() != self._signature
+        except OSError:
+            return True
+
+    def get(self):
+        """Return the cached store, reloading it if the file changed."""
+        if self.stale():
+            return self.reload()
+        return self.store
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+"""Template engine rendering profiles from a precompiled skeleton.
+
+The structure of a profile v2 object never changes, only its leaves do. The
+skeleton below describes it once: the keys, the values wrapped in a
+metadata/signature envelope and their constant classification and display
+levels. It is compiled into a single %-format string of the serialized
+profile where every envelope only leaves open its value, its display level
+when there is a choice, and its timestamps, verified flag and signatures.
+The latter are rendered in bulk for thousands of envelopes at once, so a
+profile is serialized with one format operation, without building any of
+its ~200 dicts.
+
+The random leaves come from the bulk engine, see `iam_profile_faker.bulk`.
+Rendered profiles are formatted like the stdlib `json` module does, whichever
+serializer is configured. The engine is meant for serialized output, profiles
+requested as dicts are parsed back from JSON.
+"""
+import itertools
+import json
+
+from iam_profile_faker.bulk import SCHEMA, STAFF_INFORMATION, BulkFaker, _Items, block_offset
+from iam_profile_faker.factory import (ACCESS_PUBLISHERS, C_GROUP, C_PUBLIC, C_STAFF, DISPLAY,
+                                       IDENTITIES, iter_hierarchy)
+
+_encode_string = json.encoder.encode_basestring_ascii
+
+ENVELOPE = (
+    '{{"{key}": %s, "metadata": {{"classification": {c12n}, "display": {display}, %s'
+)
+
+# Random end of an envelope, rendered in bulk
+ENVELOPE_TAIL = (
+    '"last_modified": "%s", "created": "%s", "verified": %s}, '
+    '"signature": {"publisher": %s, "additional": [%s]}}'
+)
+
+SIGNATURE = '{"alg": "RS256", "typ": "JWS", "value": "%s", "name": "%s"}'
+
+
+class Envelope(object):
+    """Skeleton node of a value wrapped with metadata and signatures."""
+
+    def __init__(self, path, display=DISPLAY, c12n=C_GROUP, key='value'):
+        self.path = path
+        self.display = display
+        self.c12n = c12n
+        # 'values' for dict and list values
+        self.key = key
+
+
+def _skeleton():
+    def envelope(path, display=DISPLAY, c12n=C_GROUP, key='value'):
+        return Envelope(path, display, c12n, key)
+
+    access_information = [
+        (publisher, envelope('access_information.' + publisher, [None], c12n, 'values'))
+        for publisher, c12n in ACCESS_PUBLISHERS
+    ] + [('hris', envelope('access_information.hris', [None], C_STAFF, 'values'))]
+
+    return [
+        ('access_information', access_information),
+        ('active', envelope('active', [None])),
+        ('alternative_name', envelope('alternative_name')),
+        ('created', envelope('created', c12n=C_PUBLIC)),
+        ('description', envelope('description')),
+        ('first_name', envelope('first_name', c12n=C_PUBLIC)),
+        ('fun_title', envelope('fun_title')),
+        ('identities', [(name, envelope('identities.' + name, display))
+                        for name, display in IDENTITIES]),
+        ('languages', envelope('languages', key='values')),
+        ('last_modified', envelope('last_modified', c12n=C_PUBLIC)),
+        ('last_name', envelope('last_name', c12n=C_PUBLIC)),
+        ('location', envelope('location')),
+        ('login_method', envelope('login_method', c12n=C_PUBLIC)),
+        ('pgp_public_keys', envelope('pgp_public_keys', c12n=C_PUBLIC, key='values')),
+        ('phone_numbers', envelope('phone_numbers', key='values')),
+        ('picture', envelope('picture', c12n=C_PUBLIC)),
+        ('primary_email', envelope('primary_email', c12n=C_PUBLIC)),
+        ('pronouns', envelope('pronouns')),
+        ('schema', SCHEMA),
+        ('ssh_public_keys', envelope('ssh_public_keys', c12n=C_PUBLIC, key='values')),
+        ('staff_information', [(name, envelope('staff_information.' + name, display, c12n))
+                               for name, _, display, c12n in STAFF_INFORMATION]),
+        ('tags', envelope('tags', key='values')),
+        ('timezone', envelope('timezone')),
+        ('uris', envelope('uris', key='values')),
+        ('user_id', envelope('user_id', ['public'], C_PUBLIC)),
+        ('usernames', envelope('usernames', ['public'], key='values')),
+    ]
+
+
+# Skeleton of a profile: lists of (key, node) pairs are objects, nodes are
+# either nested objects, `Envelope` or constant values
+SKELETON = _skeleton()
+
+
+_SCALARS = {None: 'null', True: 'true', False: 'false'}
+
+
+def _encode(value):
+    if value.__class__ is str:
+        return _encode_string(value)
+    if value is None or value.__class__ is bool:
+        return _SCALARS[value]
+    return json.dumps(value)
+
+
+class ProfileTemplate(object):
+    """Skeleton compiled into a format string of the serialized profile."""
+
+    def __init__(self, skeleton=SKELETON):
+        # Envelopes in the order they are filled, with their JSON encoded
+        # display levels when there is more than one
+        self.envelopes = []
+        self.format = self._compile(skeleton)
+
+    def _compile(self, node):
+        if isinstance(node, list):
+            return '{' + ', '.join('{0}: {1}'.format(_encode(key), self._compile(child))
+                                   for key, child in node) + '}'
+        if isinstance(node, Envelope):
+            if len(node.display) > 1:
+                display = [_encode(level) for level in node.display]
+                self.envelopes.append((node.path, display))
+                return ENVELOPE.format(key=node.key, c12n=_encode(node.c12n), display='%s')
+            self.envelopes.append((node.path, None))
+            return ENVELOPE.format(key=node.key, c12n=_encode(node.c12n),
+                                   display=_encode(node.display[0]))
+        return _encode(node).replace('%', '%%')
+
+    def render(self, values, rand, tails):
+        """Serialize a profile to a JSON string.
+
+        `values` are the leaf values keyed by path, `rand` draws the display
+        levels and `tails` returns the next rendered envelope tail.
+        """
+        arguments = []
+        append = arguments.append
+        for path, display in self.envelopes:
+            append(_encode(values.get(path)))
+            if display is not None:
+                append(display[int(rand() * len(display))])
+            append(tails())
+        return self.format % tuple(arguments)
+
+
+class TemplateFaker(BulkFaker):
+    """Bulk faker filling a compiled `ProfileTemplate` with its random leaves."""
+
+    template = ProfileTemplate()
+
+    def __init__(self, *args, **kwargs):
+        BulkFaker.__init__(self, *args, **kwargs)
+        self.tails = _Items(self._tails)
+
+    def _tails(self, count):
+        rand = self.random.random
+        counts = [1 + int(rand() * 6) for _ in range(count)]
+        signatures = [SIGNATURE % pair for pair in self._signature_pairs(sum(counts))]
+        tails = []
+        position = 0
+        for (created, last_modified), number in zip(self._timestamps(count), counts):
+            tails.append(ENVELOPE_TAIL % (
+                last_modified, created, 'true' if rand() < 0.5 else 'false',
+                signatures[position], ', '.join(signatures[position + 1:position + number])))
+            position += number
+        return tails
+
+    def _reseed(self, block):
+        BulkFaker._reseed(self, block)
+        self.tails.items = []
+
+    def create(self):
+        """Generate the next profile v2 object of the block."""
+        return json.loads(self.create_encoded())
+
+    def create_encoded(self):
+        """Generate the next profile v2 object of the block, serialized to JSON bytes."""
+        return self.template.render(self.values(), self.random.random,
+                                    self.tails.pop).encode('utf-8')
+
+    def iter_encoded(self, count, start=0):
+        """Yield `count` serialized profiles, see `iter_profiles`."""
+        return self._iter(self.create_encoded, count, start)
+
+
+def iter_template_profiles(count, start=0, seed=None, locale=None, encoded=False, org=None):
+    """Yield `count` profiles generated by the template engine.
+
+    With `encoded` the profiles are yielded serialized to JSON bytes.
+    """
+    skip = block_offset(start, seed)
+    faker = TemplateFaker(locale=locale, seed=seed,
+                          hierarchy=iter_hierarchy(start - skip, count + skip, seed, org))
+    if encoded:
+        profiles = faker.iter_encoded(count + skip, start=start - skip)
+    else:
+        profiles = faker.iter_profiles(count + skip, start=start - skip)
+    return itertools.islice(profiles, skip, None)
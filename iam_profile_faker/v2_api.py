@@ -1,11 +1,21 @@
+import hashlib
+import json
+import multiprocessing
 import os
-from tinydb import TinyDB
 
-from flask import Flask
+import click
+
+from flask import Flask, Response, request
 from flask_cors import CORS
-from flask_restful import Resource, Api
+from flask_restful import Resource, Api, abort
 
 from iam_profile_faker import V2ProfileFactory
+from iam_profile_faker.cache import LRUCache
+from iam_profile_faker.graphql_schema import schema
+from iam_profile_faker.instrumentation import Instrumentation
+from iam_profile_faker.pool import ProfilePool
+from iam_profile_faker.store import (
+    CachedStore, int_argument, locate_store, page_arguments, page_profiles)
 
 
 app = Flask(__name__)
@@ -15,35 +25,138 @@ CORS(app)
 
 # Helper functions
 def _load_db():
-    """Load the saved db file."""
-    path = os.path.dirname(os.path.abspath(__file__))
-    for file in os.listdir(path):
-        if file.endswith('.json'):
-            return os.path.join(path, file)
+    """Load the saved db file, see `locate_store`."""
+    return locate_store(os.path.dirname(os.path.abspath(__file__)))
+
+
+# The persistent store is loaded once and kept in memory, the file is checked
+# for changes at most every FAKER_DB_CHECK_INTERVAL seconds
+persistent_store = CachedStore(
+    _load_db, check_interval=float(os.environ.get('FAKER_DB_CHECK_INTERVAL', 5)))
+
+
+# Optional timing of the profile generators, enabled by setting FAKER_INSTRUMENT
+instrumentation = Instrumentation() if os.environ.get('FAKER_INSTRUMENT') else None
+
+
+# Shared by all the request threads, each of them gets its own faker
+factory = V2ProfileFactory(instrumentation=instrumentation)
+
+
+# Optional pool of pre-generated profiles for the random endpoints, enabled
+# by setting FAKER_POOL_SIZE
+profile_pool = None
+if int(os.environ.get('FAKER_POOL_SIZE', 0)) > 0:
+    profile_pool = ProfilePool(
+        size=int(os.environ['FAKER_POOL_SIZE']),
+        low_water=(int(os.environ['FAKER_POOL_LOW_WATER'])
+                   if 'FAKER_POOL_LOW_WATER' in os.environ else None),
+        refill_workers=int(os.environ.get('FAKER_POOL_REFILL_WORKERS', 0)))
+
+
+# Serialized responses of seeded requests, bounded by FAKER_CACHE_BYTES
+response_cache = LRUCache(int(os.environ.get('FAKER_CACHE_BYTES', 64 * 1024 * 1024)))
+
+# Largest batch a client can request from /users
+MAX_COUNT = int(os.environ.get('FAKER_MAX_COUNT', 10000))
+
+
+def _int_argument(name, minimum):
+    """Return query string argument `name` as an int, None if it is missing."""
+    try:
+        return int_argument(request.args, name, minimum)
+    except ValueError as error:
+        abort(400, message=str(error))
+
+
+def _json_response(body):
+    """Return serialized JSON `body` as is, without flask_restful encoding it again."""
+    return Response(body, mimetype='application/json')
+
+
+def _stream_json_array(items):
+    """Stream already serialized JSON items as a JSON array."""
+    yield '['
+    separator = ''
+    for item in items:
+        yield separator
+        yield item
+        separator = ', '
+    yield ']\n'
 
 
 class RandomUsers(Resource):
     """Return users from the profile faker."""
 
     def get(self, count=100, export_json=True):
-        factory = V2ProfileFactory()
-        return factory.create_batch(count, export_json=True)
+        """Return `count` random users.
+
+        The `count` and `seed` query string arguments override the number of
+        users and make the response reproducible. Responses for a seed are
+        cached and carry an ETag, so clients can revalidate them with
+        If-None-Match.
+        """
+        count = _int_argument('count', 1) or count
+        if count > MAX_COUNT:
+            abort(400, message='count must be <= {0}'.format(MAX_COUNT))
+        seed = _int_argument('seed', 0)
+        if seed is not None:
+            return self._get_seeded(count, seed)
+
+        if profile_pool:
+            return _json_response(b'[' + b', '.join(profile_pool.pop_many(count)) + b']')
+        return _json_response(factory.create_batch(count, export_json=True, as_bytes=True))
+
+    def _get_seeded(self, count, seed):
+        key = (count, seed)
+        cached = response_cache.get(key)
+        if cached is None:
+            body = factory.create_batch(count, export_json=True, seed=seed, as_bytes=True)
+            cached = (body, hashlib.sha1(body).hexdigest())
+            response_cache.set(key, cached, size=len(body))
+
+        body, etag = cached
+        response = _json_response(body)
+        response.set_etag(etag)
+        return response.make_conditional(request)
 
 
 class RandomUser(Resource):
     """Return a single user."""
 
     def get(self, export_json=True):
-        return V2ProfileFactory().create(export_json=export_json)
+        if not export_json:
+            return factory.create()
+        if profile_pool:
+            return _json_response(profile_pool.pop())
+        return _json_response(factory.create(export_json=True, as_bytes=True))
 
 
 class PersistentUsers(Resource):
     """Return users stored in a file."""
 
     def get(self):
-        """Return all the users from the db."""
-        db = TinyDB(_load_db())
-        return db.all()
+        """Return the users from the db.
+
+        The query string arguments select what is returned:
+
+        * `limit`: maximum number of users to return
+        * `cursor`: return the users after this cursor
+        * `fields`: comma separated list of (dotted) fields to return
+
+        When there are more users than `limit`, the cursor of the next page
+        is sent in the `X-Next-Cursor` header. Users are serialized one by one
+        while the response is streamed.
+        """
+        try:
+            cursor, limit, fields = page_arguments(request.args)
+        except ValueError as error:
+            abort(400, message=str(error))
+
+        items, next_cursor = page_profiles(persistent_store.get(), cursor, limit, fields)
+        headers = {'X-Next-Cursor': str(next_cursor)} if next_cursor is not None else {}
+        return Response(_stream_json_array(items), mimetype='application/json',
+                        headers=headers)
 
 
 class PersistentUser(Resource):
@@ -51,22 +164,131 @@ class PersistentUser(Resource):
 
     def get(self, user_id):
         """Return a single user with id `user_id`."""
-        db = TinyDB(_load_db())
-        profiles = db.all()
-        for profile in profiles:
-            if profile["user_id"]["value"] == user_id:
-                return profile
-        return None
+        return persistent_store.get().get(user_id)
+
+
+class PersistentReload(Resource):
+    """Reload the persistent store."""
+
+    def post(self):
+        """Locate and load the db file again."""
+        store = persistent_store.reload()
+        return {'path': os.path.basename(persistent_store.path), 'profiles': len(store)}
+
+
+class PoolStats(Resource):
+    """Return the profile pool counters."""
+
+    def get(self):
+        if not profile_pool:
+            abort(404, message='The profile pool is disabled.')
+        return profile_pool.stats()
+
+
+class GraphQL(Resource):
+    """Run GraphQL queries over lazily generated profiles, see `graphql_schema`."""
+
+    def _execute(self, query, variables=None, operation_name=None):
+        if not query or not isinstance(query, str):
+            abort(400, message='A GraphQL query is required.')
+        if variables is not None and not isinstance(variables, dict):
+            abort(400, message='variables must be a JSON object')
+        if operation_name is not None and not isinstance(operation_name, str):
+            abort(400, message='operationName must be a string')
+        result = schema.execute(query, variable_values=variables, operation_name=operation_name)
+        body = {'data': result.data}
+        if result.errors:
+            body['errors'] = [{'message': str(error)} for error in result.errors]
+        return body, 400 if result.data is None else 200
+
+    def get(self):
+        """Run the `query` query string argument, with JSON encoded `variables`."""
+        try:
+            variables = json.loads(request.args.get('variables') or 'null')
+        except ValueError:
+            abort(400, message='variables must be a JSON object')
+        return self._execute(request.args.get('query'), variables,
+                             request.args.get('operationName'))
+
+    def post(self):
+        """Run the query of a `{"query", "variables", "operationName"}` JSON body."""
+        body = request.get_json(silent=True)
+        if body is None:
+            body = {}
+        if not isinstance(body, dict):
+            abort(400, message='The body must be a JSON object.')
+        return self._execute(body.get('query'), body.get('variables'), body.get('operationName'))
+
+
+class Metrics(Resource):
+    """Return the generator timings in the Prometheus text format."""
+
+    def get(self):
+        if instrumentation is None:
+            abort(404, message='Instrumentation is disabled.')
+        return Response(instrumentation.prometheus(),
+                        mimetype='text/plain; version=0.0.4')
 
 
 api.add_resource(RandomUsers, '/', '/users')
 api.add_resource(RandomUser, '/user')
 api.add_resource(PersistentUsers, '/persistent/users')
 api.add_resource(PersistentUser, '/persistent/user/<string:user_id>')
+api.add_resource(PersistentReload, '/persistent/reload')
+api.add_resource(PoolStats, '/pool/stats')
+api.add_resource(GraphQL, '/graphql')
+api.add_resource(Metrics, '/metrics')
+
+
+def _available_cores():
+    """Return the number of CPU cores this process may run on."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return multiprocessing.cpu_count()
+
+
+def run_server(bind, workers, threads, timeout):
+    """Serve the API with gunicorn.
+
+    Every worker is a separate process, so CPU bound profile generation in one
+    worker does not hold the GIL of the others. Threads only help when
+    requests wait on I/O, with more than one the gthread worker is used.
+    """
+    from gunicorn.app.base import BaseApplication
+
+    class Application(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', bind)
+            self.cfg.set('workers', workers)
+            self.cfg.set('threads', threads)
+            self.cfg.set('worker_class', 'gthread' if threads > 1 else 'sync')
+            self.cfg.set('timeout', timeout)
+
+        def load(self):
+            return app
+
+    Application().run()
+
+
+@click.group(invoke_without_command=True)
+@click.pass_context
+def main(ctx):
+    """Run the API, with the Flask debug server if no command is given."""
+    if ctx.invoked_subcommand is None:
+        app.run(host='0.0.0.0', debug=True)
 
 
-def main():
-    app.run(host='0.0.0.0', debug=True)
+@main.command()
+@click.option('--bind', default='0.0.0.0:5000', help='Address to listen on.')
+@click.option('--workers', type=int, default=None,
+              help='Number of worker processes, defaults to the available cores.')
+@click.option('--threads', type=int, default=1, help='Number of threads per worker.')
+@click.option('--timeout', type=int, default=120,
+              help='Seconds before a silent worker is restarted.')
+def serve(bind, workers, threads, timeout):
+    """Serve the API with a multi-process production server."""
+    run_server(bind, workers or _available_cores(), threads, timeout)
 
 
 if __name__ == '__main__':
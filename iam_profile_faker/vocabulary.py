@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+"""Pools of values sampled from Faker providers, shared by all the fakers of a process.
+
+Many profile values come from small fixed vocabularies (countries, time
+zones, jobs...). Instead of calling the provider for every value, it is
+sampled once per locale into a pool of interned strings and values are then
+picked from the pool with a plain index draw. Names are picked from the
+whole weighted collections of the locale, so they follow the provider's own
+distribution. The bulk engine also samples providers with an unbounded
+number of values (URIs, phone numbers...), it trades their distribution for
+speed.
+
+Pools are sampled with a fixed seed, so they are the same in every process
+and seeded profiles stay reproducible. They are built lazily, kept for the
+lifetime of the process and, when a cache directory is given or set with the
+IAM_PROFILE_FAKER_CACHE_DIR environment variable, stored on disk for the next
+processes, since sampling them is most of the latency of the first profile.
+"""
+import bisect
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+
+# Number of values sampled for every pool, small vocabularies are sampled
+# enough times to hold nearly all their values in the right proportions
+POOL_SIZE = 1024
+POOL_SIZES = {
+    'color_name': 4096,
+    'country': 4096,
+    'country_code': 4096,
+    'job': 4096,
+    'language_code': 4096,
+    'state': 4096,
+    'timezone': 4096,
+}
+
+# Providers picking from a weighted collection of the locale, the attribute
+# of the provider holding it. `Vocabulary.choice` picks from the whole
+# collection with its weights instead of from a sampled pool.
+ELEMENTS = {
+    'first_name': 'first_names',
+    'last_name': 'last_names',
+}
+
+_vocabularies = {}
+
+
+def default_cache_dir():
+    """Return the directory pools are cached in, None if the disk cache is disabled.
+
+    The disk cache is opt-in, enabled by setting IAM_PROFILE_FAKER_CACHE_DIR.
+    """
+    return os.environ.get('IAM_PROFILE_FAKER_CACHE_DIR') or None
+
+
+class Vocabulary(object):
+    """Lazily sampled value pools of the Faker providers of `locale`.
+
+    Pools are built under a lock, the Faker instance sampling them is shared
+    by the threads of the process.
+    """
+
+    def __init__(self, locale=None, cache_dir=None):
+        self.locale = locale
+        self.cache_dir = cache_dir if cache_dir is not None else default_cache_dir()
+        self.pools = {}
+        # (values, cumulative weights) of the `ELEMENTS` collections
+        self.elements = {}
+        self._fake = None
+        self._lock = threading.Lock()
+
+    def _cache_path(self, name, size):
+        import faker
+        filename = 'vocabulary-{0}-{1}-{2}-{3}.json'.format(
+            faker.VERSION, self.locale or 'default', name, size)
+        return os.path.join(self.cache_dir, filename)
+
+    def _faker(self):
+        if self._fake is None:
+            # Imported on first use, it takes most of the package import time
+            from faker import Faker
+            self._fake = Faker(self.locale)
+        return self._fake
+
+    def _sample(self, name):
+        fake = self._faker()
+        provider = getattr(fake, name)
+        fake.random = random.Random('vocabulary:{0}:{1}'.format(self.locale, name))
+        return [provider() for _ in range(POOL_SIZES.get(name, POOL_SIZE))]
+
+    def _collection(self, name):
+        provider = getattr(self._faker(), name).__self__
+        collection = getattr(provider, ELEMENTS[name])
+        if isinstance(collection, dict):
+            values, weights = list(collection), list(collection.values())
+        else:
+            values, weights = list(collection), [1] * len(collection)
+        return [values, list(itertools.accumulate(weights))]
+
+    def _load(self, name, size, build):
+        if self.cache_dir:
+            try:
+                with open(self._cache_path(name, size)) as f:
+                    return json.load(f)
+            except (IOError, ValueError):
+                pass
+
+        values = build(name)
+        if self.cache_dir:
+            try:
+                self._store(name, size, values)
+            except (IOError, OSError):
+                # The cache is an optimization, read only file systems are fine
+                pass
+        return values
+
+    def _store(self, name, size, values):
+        # Written to a temporary file first, concurrent processes may build
+        # the same pool
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        fd, path = tempfile.mkstemp(dir=self.cache_dir)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(values, f)
+        os.rename(path, self._cache_path(name, size))
+
+    def pool(self, name):
+        """Return the tuple of values sampled from the Faker provider `name`."""
+        try:
+            return self.pools[name]
+        except KeyError:
+            pass
+        with self._lock:
+            if name not in self.pools:
+                values = self._load(name, POOL_SIZES.get(name, POOL_SIZE), self._sample)
+                self.pools[name] = tuple(sys.intern(value) for value in values)
+            return self.pools[name]
+
+    def collection(self, name):
+        """Return the (values, cumulative weights) collection of the Faker provider `name`."""
+        try:
+            return self.elements[name]
+        except KeyError:
+            pass
+        with self._lock:
+            if name not in self.elements:
+                values, weights = self._load(name, 'all', self._collection)
+                self.elements[name] = (tuple(sys.intern(value) for value in values), weights)
+            return self.elements[name]
+
+    def choice(self, name, rng):
+        """Return a value of the Faker provider `name` picked with the `random.Random` `rng`.
+
+        Values of the `ELEMENTS` providers are picked with their weights, the
+        others from the pool of `name`.
+        """
+        if name in ELEMENTS:
+            values, weights = self.collection(name)
+            position = bisect.bisect(weights, rng.random() * weights[-1])
+            return values[min(position, len(values) - 1)]
+        pool = self.pool(name)
+        return pool[int(rng.random() * len(pool))]
+
+
+def get_vocabulary(locale=None):
+    """Return the `Vocabulary` of `locale` shared by the whole process."""
+    try:
+        return _vocabularies[locale]
+    except KeyError:
+        return _vocabularies.setdefault(locale, Vocabulary(locale))
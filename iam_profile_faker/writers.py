@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+"""Streaming writers for batches of profile v2 objects.
+
+The writers take profiles already serialized to JSON bytes, see
+`V2ProfileFactory.iter_encoded`, and write them to binary file objects. Text
+file objects are supported too, at the cost of decoding every profile.
+"""
+import contextlib
+import gzip
+import io
+import sys
+
+# Size of the write buffer in front of output files and compressors
+BUFFER_SIZE = 1024 * 1024
+
+# File extension added for every compression format
+COMPRESSION_EXTENSIONS = {
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+
+
+def _writer(fp):
+    """Return a function writing bytes to `fp`."""
+    if isinstance(fp, io.TextIOBase):
+        return lambda data: fp.write(data.decode('utf-8'))
+    return fp.write
+
+
+def write_json_array(encoded, fp):
+    """Write serialized profiles to `fp` as a JSON array, one profile at a time.
+
+    With the stdlib serializer the output is identical to
+    `json.dumps(list(profiles))` but only a single profile is held in memory
+    at any point.
+    """
+    write = _writer(fp)
+    write(b'[')
+    separator = b''
+    for profile in encoded:
+        write(separator)
+        write(profile)
+        separator = b', '
+    write(b']')
+
+
+def write_ndjson(encoded, fp):
+    """Write serialized profiles to `fp` as newline delimited JSON (one profile per line)."""
+    write = _writer(fp)
+    for profile in encoded:
+        write(profile)
+        write(b'\n')
+
+
+def write_batch(encoded, fp, ndjson=False):
+    """Stream serialized profiles to `fp` either as NDJSON or as a JSON array."""
+    if ndjson:
+        write_ndjson(encoded, fp)
+    else:
+        write_json_array(encoded, fp)
+
+
+@contextlib.contextmanager
+def open_output(path, compress=None, level=None, buffer_size=BUFFER_SIZE):
+    """Open `path` for writing, `-` being stdout, compressing on the fly.
+
+    `compress` is None, 'gzip' or 'zstd' (requires the `zstandard` package),
+    `level` defaults to the compressor's default. Writes are gathered in a
+    buffer of `buffer_size` bytes, so memory use does not depend on how much
+    is written. Stdout is flushed but left open.
+    """
+    if path == '-':
+        raw = getattr(sys.stdout, 'buffer', sys.stdout)
+    else:
+        raw = open(path, 'wb')
+
+    try:
+        if compress == 'gzip':
+            compressor = gzip.GzipFile(fileobj=raw, mode='wb',
+                                       compresslevel=9 if level is None else level)
+        elif compress == 'zstd':
+            import zstandard
+            compressor = zstandard.ZstdCompressor(level=3 if level is None else level)
+            compressor = compressor.stream_writer(raw, closefd=False)
+        elif compress is None:
+            compressor = None
+        else:
+            raise ValueError('Unknown compression {0}'.format(compress))
+
+        output = io.BufferedWriter(compressor or _Unclosable(raw), buffer_size)
+        yield output
+        output.close()
+    finally:
+        raw.flush()
+        if raw is not getattr(sys.stdout, 'buffer', sys.stdout):
+            raw.close()
+
+
+class _Unclosable(io.RawIOBase):
+    """Raw stream writing to `fp` without closing it."""
+
+    def __init__(self, fp):
+        self.fp = fp
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.fp.write(data)
+        return len(data)
@@ -10,9 +10,13 @@ with open('HISTORY.rst') as history_file:
 
 setup_requirements = []
 base_requirements = ['Click>=6.0', 'Faker', 'tinydb']
-api_requirements = ['flask', 'flask_restful', 'flask-graphql', 'graphene', 'requests',
-                    'ipdb', 'aniso8601', 'flask-cors']
-test_requirements = ['jsonschema', 'mock', 'tinydb', 'requests']
+api_requirements = ['flask', 'flask_restful', 'graphene>=3', 'requests', 'ipdb', 'aniso8601',
+                    'flask-cors', 'gunicorn']
+async_requirements = ['aiohttp']
+fast_requirements = ['orjson']
+zstd_requirements = ['zstandard']
+test_requirements = ['jsonschema', 'mock', 'tinydb', 'requests', 'graphene>=3', 'aiohttp',
+                     'flask', 'flask_restful', 'flask-cors', 'gunicorn']
 
 setup(
     author="John Giannelos",
@@ -22,23 +26,28 @@ setup(
         'Intended Audience :: Developers',
         'License :: OSI Approved :: Apache Software License',
         'Natural Language :: English',
-        "Programming Language :: Python :: 2",
-        'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
     ],
     description="Object generator based on IAM profile v2 schema",
     entry_points={
         'console_scripts': [
             'iam_profile_faker=iam_profile_faker.cli:main',
-            'iam_profile_faker_api=iam_profile_faker.v2_api:main'
+            'iam_profile_faker_api=iam_profile_faker.v2_api:main',
+            'iam_profile_faker_async_api=iam_profile_faker.async_api:main',
         ],
     },
     install_requires=base_requirements,
     extras_require={
-        'api': api_requirements
+        'api': api_requirements,
+        'async': async_requirements,
+        'fast': fast_requirements,
+        'zstd': zstd_requirements,
     },
     license="Apache Software License 2.0",
     long_description=readme + '\n\n' + history,
@@ -46,6 +55,7 @@ setup(
     keywords='iam_profile_faker',
     name='iam_profile_faker',
     packages=find_packages(include=['iam_profile_faker']),
+    python_requires='>=3.7',
     setup_requires=setup_requirements,
     test_suite='tests',
     tests_require=test_requirements,
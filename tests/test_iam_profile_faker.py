@@ -3,16 +3,41 @@
 
 """Tests for `iam_profile_faker` package."""
 
+import asyncio
+import datetime
+import gzip
+import json
 import mock
+import os
+import pickle
+import random
+import shutil
+import tempfile
+import threading
+import time
 import unittest
+import weakref
 
 import requests
 
+from aiohttp.test_utils import AioHTTPTestCase
 from click.testing import CliRunner
 from jsonschema import validate
 
-from iam_profile_faker import cli
-from iam_profile_faker.factory import V2ProfileFactory
+from iam_profile_faker import async_api, cli, graphql_schema, v2_api
+from iam_profile_faker import compact as compact_module
+from iam_profile_faker.cache import LRUCache
+from iam_profile_faker.compact import Node, to_compact
+from iam_profile_faker.envelope import EnvelopeGenerator
+from iam_profile_faker.factory import ENGINES, IAMFaker, V2ProfileFactory
+from iam_profile_faker.graphql_schema import schema
+from iam_profile_faker.hierarchy import OrgHierarchy
+from iam_profile_faker.instrumentation import Instrumentation
+from iam_profile_faker.pool import ProfilePool
+from iam_profile_faker.records import write_records
+from iam_profile_faker.serializers import SERIALIZERS, get_serializer
+from iam_profile_faker.store import CachedStore, MemoryStore, open_store, project_profile
+from iam_profile_faker.vocabulary import POOL_SIZES, Vocabulary
 
 
 class TestIAMProfileFaker(unittest.TestCase):
@@ -51,6 +76,753 @@ class TestIAMProfileFaker(unittest.TestCase):
         assert create_result.exit_code == 0
         assert create_result.output == '[{"foo": "bar"}, {"foo": "bar"}]\n'
 
+    @mock.patch('iam_profile_faker.factory.IAMFaker.create')
+    def test_004_factory_iter_batch(self, mock_create):
+        """Test lazy batch generation."""
+        mock_create.return_value = {'foo': 'bar'}
+        factory = V2ProfileFactory()
+        batch = factory.iter_batch(3)
+        assert mock_create.call_count == 0
+        assert next(batch) == {'foo': 'bar'}
+        assert mock_create.call_count == 1
+        assert list(batch) == [{'foo': 'bar'}, {'foo': 'bar'}]
+
+    @mock.patch('iam_profile_faker.factory.IAMFaker.create')
+    def test_005_command_line_interface_create_batch_ndjson(self, mock_create):
+        """Test create batch cli with NDJSON output."""
+        runner = CliRunner()
+        mock_create.return_value = {'foo': 'bar'}
+        create_result = runner.invoke(cli.main, ['create-batch', '--count', 2, '--ndjson'])
+        assert create_result.exit_code == 0
+        assert create_result.output == '{"foo": "bar"}\n{"foo": "bar"}\n'
+
+    def test_006_factory_create_batch_workers(self):
+        """Test parallel batch generation is reproducible for a seed."""
+        factory = V2ProfileFactory()
+        batch = factory.create_batch(5, workers=2, seed=1)
+        assert batch == factory.create_batch(5, workers=3, seed=1)
+        assert batch == factory.create_batch(5, seed=1)
+        hris = [obj['access_information']['hris']['values'] for obj in batch]
+        assert [values['EmployeeID'] for values in hris] == [1, 2, 3, 4, 5]
+        for values in hris:
+            assert values['WorkersManagersEmployeeID'] < values['EmployeeID']
+
+    def test_007_envelope_generator(self):
+        """Test envelope generator output."""
+        now = datetime.datetime(2019, 1, 1)
+        envelope = EnvelopeGenerator(random.Random(0), now=now)
+        for _ in range(100):
+            metadata = envelope.metadata(['public', 'staff'], 'PUBLIC')
+            assert metadata['classification'] == 'PUBLIC'
+            assert metadata['display'] in ['public', 'staff']
+            assert metadata['created'] <= metadata['last_modified'] <= now.isoformat()
+            signature = envelope.signature()
+            assert 0 <= len(signature['additional']) <= 5
+            for sig in [signature['publisher']] + signature['additional']:
+                assert [len(part) for part in sig['value'].split('.')] == [20, 20, 20]
+
+    def test_008_factory_create_seed(self):
+        """Test single profiles of a seeded batch can be regenerated."""
+        factory = V2ProfileFactory()
+        batch = factory.create_batch(4, seed=42)
+        assert factory.create(seed=42, index=3) == batch[3]
+        assert factory.create(seed=43, index=3) != batch[3]
+
+    def test_009_command_line_interface_create_seed(self):
+        """Test create cli with a seed."""
+        runner = CliRunner()
+        first = runner.invoke(cli.main, ['create', '--seed', 1, '--index', 2])
+        second = runner.invoke(cli.main, ['create', '--seed', 1, '--index', 2])
+        assert first.exit_code == 0
+        assert first.output == second.output
+
+    def test_010_factory_instrumentation(self):
+        """Test generator calls are counted when instrumentation is enabled."""
+        instrumentation = Instrumentation()
+        factory = V2ProfileFactory(instrumentation=instrumentation)
+        assert factory.create_batch(2, seed=1) == V2ProfileFactory().create_batch(2, seed=1)
+        stats = instrumentation.snapshot()
+        assert stats['create'][0] == 2
+        assert stats['hris'][0] == 2
+        assert stats['wrap_metadata_signature'][0] == stats['metadata'][0]
+        assert 'generator="create"} 2' in instrumentation.prometheus()
+
+    def test_011_serializers(self):
+        """Test every installed serializer round trips profiles."""
+        profile = V2ProfileFactory().create(seed=1)
+        for name in SERIALIZERS:
+            try:
+                serializer = get_serializer(name)
+            except ImportError:
+                continue
+            assert json.loads(serializer.dumps(profile)) == profile
+            assert json.loads(serializer.dumps_bytes(profile).decode('utf-8')) == profile
+
+    def test_012_factory_create_batch_bytes(self):
+        """Test batches can be exported as JSON bytes."""
+        factory = V2ProfileFactory()
+        output = factory.create_batch(2, export_json=True, seed=1, as_bytes=True)
+        assert json.loads(output.decode('utf-8')) == factory.create_batch(2, seed=1)
+
+    def test_013_command_line_interface_create_batch_compress(self):
+        """Test create batch cli with compressed output."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        output = os.path.join(directory, 'batch.json.gz')
+        runner = CliRunner()
+        create_result = runner.invoke(cli.main, ['create-batch', '--count', 2, '--seed', 1,
+                                                 '--compress', 'gzip', '--output', output])
+        assert create_result.exit_code == 0
+        with gzip.open(output) as f:
+            assert json.loads(f.read().decode('utf-8')) == \
+                V2ProfileFactory().create_batch(2, seed=1)
+
+    def test_014_factory_create_batch_bulk(self):
+        """Test the bulk engine is reproducible and matches the default profile shape."""
+        factory = V2ProfileFactory()
+        batch = factory.create_batch(300, seed=1, engine='bulk')
+        assert batch == factory.create_batch(300, workers=2, seed=1, engine='bulk')
+        assert batch[250:] == factory.create_batch(300, seed=1, engine='bulk')[250:]
+        assert batch != factory.create_batch(300, seed=2, engine='bulk')
+
+        expected = factory.create(seed=1)
+        for obj in batch[:10] + batch[-10:]:
+            assert sorted(obj) == sorted(expected)
+            for key in ('identities', 'staff_information', 'access_information'):
+                assert sorted(obj[key]) == sorted(expected[key])
+            assert sorted(obj['access_information']['hris']['values']) == \
+                sorted(expected['access_information']['hris']['values'])
+            assert sorted(obj['primary_email']) == sorted(expected['primary_email'])
+            assert sorted(obj['usernames']['metadata']) == \
+                sorted(expected['usernames']['metadata'])
+        hris = [obj['access_information']['hris']['values'] for obj in batch]
+        assert [values['EmployeeID'] for values in hris] == list(range(1, 301))
+
+    def test_015_vocabulary(self):
+        """Test vocabulary pools are shared, reproducible and cached on disk."""
+        assert IAMFaker().vocabulary is IAMFaker().vocabulary
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        pool = Vocabulary(cache_dir=directory).pool('country_code')
+        assert len(pool) == POOL_SIZES['country_code']
+        assert all(len(code) == 2 for code in pool)
+        assert [path.endswith('-country_code-{0}.json'.format(len(pool)))
+                for path in os.listdir(directory)] == [True]
+        with mock.patch('faker.Faker') as mock_faker:
+            assert Vocabulary(cache_dir=directory).pool('country_code') == pool
+            assert not mock_faker.called
+        with mock.patch.dict(os.environ, {'IAM_PROFILE_FAKER_CACHE_DIR': ''}):
+            assert Vocabulary().cache_dir is None
+            assert Vocabulary().pool('country_code') == pool
+
+        # Pools built by concurrent threads are the same as sequential ones
+        names = ['country', 'job', 'timezone', 'city', 'state', 'company', 'color_name']
+        vocabulary = Vocabulary(cache_dir='')
+        threads = [threading.Thread(target=vocabulary.pool, args=(name,)) for name in names]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        sequential = Vocabulary(cache_dir='')
+        assert all(vocabulary.pools[name] == sequential.pool(name) for name in names)
+
+        # Names are picked from the whole weighted collection of the locale
+        values, weights = sequential.collection('first_name')
+        assert len(set(values)) == len(values) == len(weights) > 100
+        rng = random.Random(1)
+        assert len(set(sequential.choice('first_name', rng) for _ in range(5000))) > 300
+
+    def test_016_factory_reuses_faker_per_thread(self):
+        """Test the factory keeps one faker per thread and seeded profiles are unaffected."""
+        factory = V2ProfileFactory()
+        seeded = factory.create(seed=5, index=2)
+        assert factory.create() != factory.create()
+        assert factory.create(seed=5, index=2) == seeded
+        assert factory._faker() is factory._faker()
+
+        fakers = []
+        thread = threading.Thread(target=lambda: fakers.append(factory._faker()))
+        thread.start()
+        thread.join()
+        assert fakers[0] is not factory._faker()
+
+    def test_017_factory_create_batch_template(self):
+        """Test the template engine renders the same profiles as it builds, in any mode."""
+        factory = V2ProfileFactory()
+        batch = factory.create_batch(300, seed=1, engine='template')
+        encoded = list(factory.iter_encoded(300, seed=1, engine='template'))
+        assert [json.loads(obj.decode('utf-8')) for obj in encoded] == batch
+        assert [json.dumps(obj).encode('utf-8') for obj in batch] == encoded
+        assert encoded == list(factory.iter_encoded(300, workers=2, seed=1, engine='template'))
+        assert batch != factory.create_batch(300, seed=2, engine='template')
+
+        expected = factory.create_batch(1, seed=1, engine='bulk')[0]
+        for obj in batch[:10] + batch[-10:]:
+            assert sorted(obj) == sorted(expected)
+            for key in ('identities', 'staff_information', 'access_information'):
+                assert sorted(obj[key]) == sorted(expected[key])
+            assert sorted(obj['usernames']['metadata']) == \
+                sorted(expected['usernames']['metadata'])
+        hris = [obj['access_information']['hris']['values'] for obj in batch]
+        assert [values['EmployeeID'] for values in hris] == list(range(1, 301))
+
+    def test_018_org_hierarchy(self):
+        """Test the org tree shape and that HRIS records point at their manager's profile."""
+        org = OrgHierarchy(2000, seed=1, span=(2, 4, 6), max_depth=6)
+        assert org.manager(1) == 0
+        for employee_id in range(2, 2001):
+            manager_id = org.manager(employee_id)
+            assert 0 < manager_id < employee_id
+            assert org.depth(employee_id) == org.depth(manager_id) + 1 <= 6
+        spans = [org.direct_reports(employee_id) for employee_id in range(1, 2001)]
+        assert sum(spans) == 1999
+        assert all(span <= 6 for span in spans)
+        copy = pickle.loads(pickle.dumps(org))
+        assert list(copy.managers) == list(org.managers)
+        assert copy.person(10) == org.person(10)
+        with self.assertRaises(ValueError):
+            OrgHierarchy(100, span=(1, 1, 1), max_depth=3)
+
+        factory = V2ProfileFactory()
+        org = OrgHierarchy(300, seed=2)
+        for engine in ENGINES:
+            batch = factory.create_batch(300, seed=1, engine=engine, org=org)
+            assert batch == factory.create_batch(300, workers=2, seed=1, engine=engine, org=org)
+            hris = dict((values['EmployeeID'], values) for values in
+                        (obj['access_information']['hris']['values'] for obj in batch))
+            assert sorted(hris) == list(range(1, 301))
+            store = MemoryStore(batch)
+            for employee_id, values in hris.items():
+                manager_id = values['WorkersManagersEmployeeID']
+                assert manager_id == org.manager(employee_id)
+                assert values['IsManager'] == (org.direct_reports(employee_id) > 0)
+                assert values['isDirectorOrAbove'] == (values['IsManager'] and
+                                                       org.depth(employee_id) < 3)
+                if manager_id:
+                    manager = hris[manager_id]
+                    assert values['WorkersManager'] == manager['Preferred_Name']
+                    assert values['Worker_s_Manager_s_Email_Address'] == \
+                        manager['primary_work_email']
+                    profile = store.get_by_email(values['Worker_s_Manager_s_Email_Address'])
+                    assert profile['access_information']['hris']['values'] == manager
+                    assert values['WorkersManager'] == '{0} {1}'.format(
+                        profile['first_name']['value'], profile['last_name']['value'])
+        with self.assertRaises(ValueError):
+            factory.create_batch(301, org=org)
+
+    def test_019_lazy_profile(self):
+        """Test that lazy profiles only generate the accessed fields, in any order."""
+        factory = V2ProfileFactory()
+        eager = factory.create(seed=3, index=5)
+        assert eager == factory.create_batch(6, seed=3)[5]
+
+        lazy = factory.create_lazy(seed=3, index=5)
+        assert lazy['user_id'] == eager['user_id']
+        assert sorted(lazy._values) == ['login_method', 'user_id']
+        assert lazy['staff_information'] == eager['staff_information']
+        assert dict(lazy) == eager
+        assert list(lazy.values()) == [eager[name] for name in lazy]
+        assert dict(lazy.items()) == eager
+        with self.assertRaises(KeyError):
+            lazy['_hris']
+
+        lazy = factory.create_lazy()
+        login_method = lazy['login_method']['value']
+        assert lazy['user_id']['value'].startswith(login_method + '|')
+        assert lazy['staff_information']['title']['value'] == \
+            lazy['access_information']['hris']['values']['businessTitle']
+        for name in SERIALIZERS:
+            serializer = get_serializer(name)
+            assert json.loads(serializer.dumps(lazy)) == dict(lazy)
+
+    def test_020_compact_profiles(self):
+        """Test compact profiles read and serialize like the dicts they stand for."""
+        factory = V2ProfileFactory()
+        batch = factory.create_batch(5, seed=2)
+        compact = factory.create_batch(5, seed=2, compact=True)
+        assert compact == batch
+        assert [profile.to_dict() for profile in compact] == batch
+        profile, expected = compact[1], batch[1]
+        assert profile['user_id']['value'] == expected['user_id']['value']
+        assert profile['access_information']['hris']['metadata'] == \
+            expected['access_information']['hris']['metadata']
+        assert sorted(profile['staff_information']) == sorted(expected['staff_information'])
+        with self.assertRaises(KeyError):
+            profile['unknown']
+        assert dict(profile.items()) == dict(profile) and len(profile.values()) == len(expected)
+        for name in SERIALIZERS:
+            serializer = get_serializer(name)
+            assert serializer.dumps(compact) == serializer.dumps(batch)
+
+        # Only the objects of the profile schema share shapes, objects with
+        # arbitrary keys stay dicts
+        assert isinstance(profile['staff_information'], Node)
+        assert isinstance(profile['access_information']['hris']['values'], Node)
+        assert isinstance(profile['access_information']['ldap']['values'], dict)
+        assert isinstance(profile['uris']['values'], dict)
+        shapes = len(compact_module._shapes)
+        factory.create_batch(5, seed=3, compact=True)
+        assert len(compact_module._shapes) == shapes
+
+        loaded = to_compact(json.loads(json.dumps(expected)))
+        assert loaded == expected
+        assert loaded['user_id'].classification is profile['user_id'].classification
+
+    def test_021_orjson_serializer(self):
+        """Test orjson output is compact and only used when requested."""
+        try:
+            serializer = get_serializer('orjson')
+        except ImportError:
+            self.skipTest('orjson is not installed.')
+        profile = V2ProfileFactory().create(seed=1)
+        assert serializer.dumps({'a': [1, None]}) == '{"a":[1,null]}'
+        assert serializer.dumps_bytes(profile) == json.dumps(
+            profile, separators=(',', ':')).encode('utf-8')
+        with mock.patch.dict(os.environ, clear=True):
+            assert get_serializer().name == 'json'
+            assert get_serializer().dumps(profile) == json.dumps(profile)
+            os.environ['IAM_PROFILE_FAKER_JSON'] = 'auto'
+            assert get_serializer().name == 'orjson'
+
+
+class TestGraphQL(unittest.TestCase):
+    """Tests for the GraphQL schema over lazy profiles."""
+
+    QUERY = """{
+      profiles(count: 3, seed: 7) {
+        first_name { value }
+        staff_information { title { value metadata { display } } }
+        access_information { hris { values } }
+      }
+    }"""
+
+    def test_000_graphql_profiles(self):
+        """Test queries are reproducible and consistent with the profile shape."""
+        result = schema.execute(self.QUERY)
+        assert result.errors is None
+        profiles = result.data['profiles']
+        assert schema.execute(self.QUERY).data == result.data
+        assert len(profiles) == 3
+        for index, profile in enumerate(profiles):
+            hris = profile['access_information']['hris']['values']
+            assert hris['EmployeeID'] == index + 1
+            assert profile['staff_information']['title']['value'] == hris['businessTitle']
+            assert profile['staff_information']['title']['metadata']['display'] == 'ndaed'
+
+        # Attributes do not depend on the other selected ones
+        result = schema.execute('{ profiles(count: 3, seed: 7) { first_name { value } } }')
+        assert [profile['first_name'] for profile in result.data['profiles']] == \
+            [profile['first_name'] for profile in profiles]
+        assert schema.execute('{ profiles(count: 0) { schema } }').errors
+
+    def test_001_graphql_matches_factory(self):
+        """Test seeded profiles match the factory and only the selected fields are generated."""
+        profiles = []
+        create_lazy = graphql_schema._factory.create_lazy
+
+        def record(*args):
+            profiles.append(create_lazy(*args))
+            return profiles[-1]
+
+        with mock.patch.object(graphql_schema._factory, 'create_lazy', side_effect=record):
+            result = schema.execute('{ profile(seed: 5, index: 2) { '
+                                    'first_name { value } staff_information { title { value } } '
+                                    'user_id { value metadata { display } } } }')
+        assert result.errors is None
+        expected = V2ProfileFactory().create(seed=5, index=2)
+        profile = result.data['profile']
+        assert profile['first_name']['value'] == expected['first_name']['value']
+        assert profile['staff_information']['title']['value'] == \
+            expected['staff_information']['title']['value']
+        assert profile['user_id'] == {'value': expected['user_id']['value'],
+                                      'metadata': {'display': 'public'}}
+        assert sorted(profiles[0]._values) == ['_hris', 'first_name', 'login_method',
+                                               'staff_information', 'user_id']
+
+    def test_002_graphql_endpoint(self):
+        """Test /graphql runs GET and POST queries and rejects malformed ones with a 400."""
+        client = v2_api.app.test_client()
+        query = 'query ($seed: Int) { profile(seed: $seed) { first_name { value } } }'
+        expected = V2ProfileFactory().create(seed=5)['first_name']['value']
+        response = client.post('/graphql', json={'query': query, 'variables': {'seed': 5}})
+        assert response.status_code == 200
+        assert response.get_json()['data']['profile']['first_name']['value'] == expected
+        response = client.get('/graphql', query_string={
+            'query': query, 'variables': json.dumps({'seed': 5})})
+        assert response.get_json() == {'data': {'profile': {'first_name': {'value': expected}}}}
+
+        for response in [
+                client.get('/graphql', query_string={'query': query, 'variables': '[1]'}),
+                client.get('/graphql', query_string={'query': query, 'variables': '{'}),
+                client.get('/graphql'),
+                client.post('/graphql', json=[{'query': query}]),
+                client.post('/graphql', json={'query': query, 'variables': [1]}),
+                client.post('/graphql', json={'query': 1}),
+                client.post('/graphql', json={'query': query, 'operationName': 1}),
+                client.post('/graphql', json={'query': '{ profile { unknown } }'})]:
+            assert response.status_code == 400
+            assert response.get_json()
+
+
+class TestProfileStore(unittest.TestCase):
+    """Tests for the persistent profile stores."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.profiles = V2ProfileFactory().create_batch(3, seed=1)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _check_store(self, filename):
+        store = open_store(os.path.join(self.directory, filename))
+        store.insert_many(self.profiles)
+        profile = self.profiles[1]
+        assert len(store) == 3
+        assert store.all() == self.profiles
+        assert store.get(profile['user_id']['value']) == profile
+        assert store.get_by_email(profile['primary_email']['value']) == profile
+        assert store.get_by_employee_id(2) == profile
+        assert store.get('unknown') is None
+
+        page = list(store.page(after=1, limit=1))
+        assert len(page) == 1
+        assert json.loads(page[0][1]) == profile
+        assert [json.loads(item) for _, item in store.page(after=page[0][0])] == \
+            self.profiles[2:]
+
+    def test_000_sqlite_store(self):
+        """Test lookups in the SQLite store."""
+        self._check_store('db.sqlite3')
+
+    def test_001_tinydb_store(self):
+        """Test lookups in the TinyDB store."""
+        self._check_store('db.json')
+
+    def test_002_cached_store(self):
+        """Test the cached store is reloaded only when the file changes."""
+        path = os.path.join(self.directory, 'db.sqlite3')
+        open_store(path).insert_many(self.profiles[:2])
+        cached = CachedStore(lambda: path, check_interval=0)
+        store = cached.get()
+        assert len(store) == 2
+        assert cached.get() is store
+
+        page = store.page()
+        open_store(path).insert_many(self.profiles[2:])
+        stat = os.stat(path)
+        os.utime(path, (stat.st_atime, stat.st_mtime + 1))
+        assert len(cached.get()) == 3
+        # Pages being read when the store is reloaded are not cut short
+        assert [json.loads(item) for _, item in page] == self.profiles[:2]
+
+    def test_003_record_file_store(self):
+        """Test random access lookups in a record file."""
+        path = os.path.join(self.directory, 'export.ipf')
+        with open(path, 'wb') as f:
+            assert write_records(self.profiles, f) == 3
+        store = open_store(path)
+        profile = self.profiles[1]
+        assert len(store) == 3
+        assert store[2] == self.profiles[2]
+        assert store.all() == self.profiles
+        assert store.get(profile['user_id']['value']) == profile
+        assert store.get_by_email(profile['primary_email']['value']) == profile
+        assert store.get_by_employee_id(2) == profile
+        assert store.get('unknown') is None
+        assert [json.loads(item) for _, item in store.page(after=1, limit=5)] == \
+            self.profiles[1:]
+
+    def test_004_project_profile(self):
+        """Test profile projection on top level and nested fields."""
+        profile = self.profiles[0]
+        projection = project_profile(profile, ['user_id', 'staff_information.title.value',
+                                               'unknown', 'schema.unknown'])
+        title = profile['staff_information']['title']['value']
+        assert projection == {
+            'user_id': profile['user_id'],
+            'staff_information': {'title': {'value': title}}
+        }
+
+    def test_005_populate_db_resume(self):
+        """Test populate-db inserts in chunks and resumes a seeded batch where it stopped."""
+        runner = CliRunner()
+        for engine in ('default', 'bulk'):
+            path = os.path.join(self.directory, 'db-{0}.sqlite3'.format(engine))
+            options = ['--backend', 'sqlite', '--seed', 1, '--chunk-size', 7, '--engine', engine]
+            result = runner.invoke(cli.populate_db, [path, '--count', 12] + options)
+            assert result.exit_code == 0
+            assert 'Inserted 7/12 profiles' in result.output
+            result = runner.invoke(cli.populate_db, [path, '--count', 30, '--resume'] + options)
+            assert result.exit_code == 0
+            assert 'Inserted 30/30 profiles' in result.output
+            expected = V2ProfileFactory().create_batch(30, seed=1, engine=engine)
+            assert open_store(path).all() == expected
+            result = runner.invoke(cli.populate_db, [path, '--count', 30, '--resume'] + options)
+            assert 'already has 30 profiles' in result.output
+
+    def test_006_memory_store(self):
+        """Test lookups in the compact in-memory copy of a TinyDB store."""
+        path = os.path.join(self.directory, 'db.json')
+        open_store(path).insert_many(self.profiles)
+        store = open_store(path, in_memory=True)
+        profile = self.profiles[1]
+        assert store.all() == self.profiles
+        assert store.get(profile['user_id']['value']) == profile
+        assert store.get_by_employee_id(2) == profile
+        assert store.get('unknown') is None
+        assert [json.loads(item) for _, item in store.page(after=1)] == self.profiles[1:]
+
+    def test_007_export_records_replaces_file(self):
+        """Test export-records replaces the file a running store has memory mapped."""
+        runner = CliRunner()
+        path = os.path.join(self.directory, 'export.ipf')
+        with mock.patch.object(cli, '__file__', os.path.join(self.directory, 'cli.py')):
+            result = runner.invoke(cli.export_records, ['export', '--count', 3, '--seed', 1])
+            assert result.exit_code == 0
+            cached = CachedStore(lambda: path, check_interval=0)
+            store = cached.get()
+            assert store.all() == self.profiles
+            result = runner.invoke(cli.export_records, ['export', '--count', 1, '--seed', 2])
+            assert result.exit_code == 0
+        assert os.listdir(self.directory) == ['export.ipf']
+        # The previous file stays mapped while the store is in use
+        assert store.all() == self.profiles
+        page = store.page()
+        assert len(cached.get()) == 1
+        assert [json.loads(item) for _, item in page] == self.profiles
+        data = weakref.ref(store.data)
+        del store, page
+        assert data() is None
+
+
+class TestV2API(unittest.TestCase):
+    """Tests for the Flask application."""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.profiles = V2ProfileFactory().create_batch(4, seed=1)
+        self.path = os.path.join(directory, 'db.sqlite3')
+        open_store(self.path).insert_many(self.profiles[:3])
+        for name, value in [
+                ('persistent_store', CachedStore(lambda: self.path, check_interval=None)),
+                ('response_cache', LRUCache(1024 * 1024)),
+                ('profile_pool', None)]:
+            patcher = mock.patch.object(v2_api, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client = v2_api.app.test_client()
+
+    def test_000_seeded_users_etag(self):
+        """Test seeded responses carry an ETag and are revalidated with a 304."""
+        response = self.client.get('/users', query_string={'count': 2, 'seed': 4})
+        assert response.status_code == 200
+        assert response.get_json() == V2ProfileFactory().create_batch(2, seed=4)
+        etag = response.headers['ETag']
+
+        response = self.client.get('/users', query_string={'count': 2, 'seed': 4},
+                                   headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.data == b''
+        response = self.client.get('/users', query_string={'count': 2, 'seed': 5},
+                                   headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+
+    def test_001_argument_validation(self):
+        """Test invalid count, seed, limit and cursor arguments get a 400."""
+        for path, arguments in [
+                ('/users', {'count': 0}),
+                ('/users', {'count': 'ten'}),
+                ('/users', {'count': v2_api.MAX_COUNT + 1}),
+                ('/users', {'seed': -1}),
+                ('/persistent/users', {'limit': 0}),
+                ('/persistent/users', {'cursor': 'next'})]:
+            response = self.client.get(path, query_string=arguments)
+            assert response.status_code == 400
+            assert 'message' in response.get_json()
+
+    def test_002_random_users_encoded_once(self):
+        """Test serialized profiles are sent as is instead of as a JSON string."""
+        response = self.client.get('/user')
+        assert response.mimetype == 'application/json'
+        assert 'user_id' in response.get_json()
+        assert isinstance(response.get_json(), dict)
+        profiles = self.client.get('/users', query_string={'count': 2}).get_json()
+        assert len(profiles) == 2
+        assert all(isinstance(profile, dict) and 'user_id' in profile for profile in profiles)
+
+    def test_003_persistent_pagination(self):
+        """Test persistent pages link to the next one with X-Next-Cursor."""
+        response = self.client.get('/persistent/users', query_string={'limit': 2})
+        assert response.get_json() == self.profiles[:2]
+        cursor = response.headers['X-Next-Cursor']
+        response = self.client.get('/persistent/users', query_string={
+            'limit': 2, 'cursor': cursor, 'fields': 'user_id,staff_information.title'})
+        assert 'X-Next-Cursor' not in response.headers
+        assert response.get_json() == [{
+            'user_id': self.profiles[2]['user_id'],
+            'staff_information': {'title': self.profiles[2]['staff_information']['title']},
+        }]
+        user_id = self.profiles[1]['user_id']['value']
+        response = self.client.get('/persistent/user/{0}'.format(user_id))
+        assert response.get_json() == self.profiles[1]
+
+    def test_004_persistent_reload(self):
+        """Test the persistent store only changes when it is reloaded."""
+        assert len(self.client.get('/persistent/users').get_json()) == 3
+        open_store(self.path).insert_many(self.profiles[3:])
+        assert len(self.client.get('/persistent/users').get_json()) == 3
+
+        response = self.client.post('/persistent/reload')
+        assert response.status_code == 200
+        assert response.get_json() == {'path': 'db.sqlite3', 'profiles': 4}
+        assert self.client.get('/persistent/users').get_json() == self.profiles
+
+    def test_005_pool_stats(self):
+        """Test the pool counters are served when the pool is enabled."""
+        assert self.client.get('/pool/stats').status_code == 404
+        with mock.patch.object(v2_api, 'profile_pool', ProfilePool(size=2, chunk_size=1)):
+            profiles = self.client.get('/users', query_string={'count': 3}).get_json()
+            assert all('user_id' in profile for profile in profiles)
+            response = self.client.get('/pool/stats')
+        assert response.status_code == 200
+        stats = response.get_json()
+        assert stats['size'] == 2
+        assert stats['hits'] + stats['misses'] == 3
+
+    @mock.patch('gunicorn.app.base.BaseApplication.run', autospec=True)
+    def test_006_serve(self, mock_run):
+        """Test serve configures gunicorn workers and threads."""
+        runner = CliRunner()
+        with mock.patch.object(v2_api, '_available_cores', return_value=3):
+            result = runner.invoke(v2_api.main, ['serve'])
+        assert result.exit_code == 0
+        config = mock_run.call_args[0][0].cfg
+        assert config.bind == ['0.0.0.0:5000']
+        assert config.workers == 3
+        assert config.threads == 1
+        assert config.worker_class_str == 'sync'
+        assert mock_run.call_args[0][0].load() is v2_api.app
+
+        result = runner.invoke(v2_api.main, ['serve', '--bind', '127.0.0.1:8000',
+                                             '--workers', 2, '--threads', 4, '--timeout', 30])
+        assert result.exit_code == 0
+        config = mock_run.call_args[0][0].cfg
+        assert config.bind == ['127.0.0.1:8000']
+        assert config.workers == 2
+        assert config.threads == 4
+        assert config.worker_class_str == 'gthread'
+        assert config.timeout == 30
+
+
+class TestAsyncAPI(AioHTTPTestCase):
+    """Tests for the aiohttp application."""
+
+    async def get_application(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.profiles = V2ProfileFactory().create_batch(3, seed=1)
+        path = os.path.join(directory, 'db.sqlite3')
+        open_store(path).insert_many(self.profiles)
+        self.cached = CachedStore(lambda: path, check_interval=None)
+        return async_api.create_app(workers=1, max_pending=1, store=self.cached)
+
+    async def test_000_saturated_pool(self):
+        """Test generation requests beyond max_pending get a 503."""
+        pool = self.app['generation_pool']
+        pool.acquire()
+        try:
+            response = await self.client.get('/users', params={'count': 1})
+            assert response.status == 503
+            assert response.headers['Retry-After'] == '1'
+            assert 'message' in await response.json()
+            assert pool.rejected == 1
+        finally:
+            pool.release()
+        response = await self.client.get('/user')
+        assert response.status == 200
+        assert pool.pending == 0
+
+    async def test_001_chunked_users(self):
+        """Test /users streams chunks making up a single seeded batch."""
+        with mock.patch.object(async_api, 'CHUNK_SIZE', 2):
+            response = await self.client.get('/users', params={'count': 5, 'seed': 3})
+            assert response.status == 200
+            assert response.headers['Transfer-Encoding'] == 'chunked'
+            assert json.loads(await response.read()) == \
+                V2ProfileFactory().create_batch(5, seed=3)
+        response = await self.client.get('/users', params={'count': 0})
+        assert response.status == 400
+        assert await response.json() == {'message': 'count must be an integer >= 1'}
+
+    async def test_002_persistent_users(self):
+        """Test persistent pages and that the store is loaded off the event loop."""
+        threads = []
+        reload = self.cached.reload
+
+        def record():
+            threads.append(threading.current_thread())
+            return reload()
+
+        with mock.patch.object(self.cached, 'reload', side_effect=record):
+            responses = await asyncio.gather(*[
+                self.client.get('/persistent/users', params={'limit': 2}) for _ in range(3)])
+        assert len(threads) == 1
+        assert threads[0] is not threading.main_thread()
+        for response in responses:
+            assert response.headers['X-Next-Cursor'] == '2'
+            assert await response.json() == self.profiles[:2]
+
+        response = await self.client.get('/persistent/users', params={
+            'cursor': 2, 'fields': 'user_id'})
+        assert 'X-Next-Cursor' not in response.headers
+        assert await response.json() == [{'user_id': self.profiles[2]['user_id']}]
+        response = await self.client.get('/persistent/users', params={'limit': 'all'})
+        assert response.status == 400
+        user_id = self.profiles[1]['user_id']['value']
+        response = await self.client.get('/persistent/user/{0}'.format(user_id))
+        assert await response.json() == self.profiles[1]
+
+
+class TestProfilePool(unittest.TestCase):
+    """Tests for the pre-generated profile pool."""
+
+    def test_000_pool_refill(self):
+        """Test the pool serves profiles and is refilled in the background."""
+        pool = ProfilePool(size=4, low_water=2, chunk_size=2)
+        profiles = pool.pop_many(3)
+        assert len(profiles) == 3
+        assert all('user_id' in json.loads(profile) for profile in profiles)
+        assert pool.hits + pool.misses == 3
+
+        deadline = time.time() + 30
+        while pool.stats()['available'] < 4 and time.time() < deadline:
+            time.sleep(0.05)
+        hits = pool.hits
+        assert 'user_id' in json.loads(pool.pop())
+        assert pool.hits == hits + 1
+
+
+class TestLRUCache(unittest.TestCase):
+    """Tests for the size bounded LRU cache."""
+
+    def test_000_cache_eviction(self):
+        """Test least recently used values are evicted to stay under the size bound."""
+        cache = LRUCache(10)
+        cache.set('a', b'aaaa')
+        cache.set('b', b'bbbb')
+        assert cache.get('a') == b'aaaa'
+        cache.set('c', b'cccc')
+        assert cache.get('b') is None
+        assert cache.get('a') == b'aaaa'
+        assert cache.get('c') == b'cccc'
+        assert cache.size == 8
+        cache.set('d', b'd' * 11)
+        assert cache.get('d') is None
+        assert len(cache) == 2
+
 
 class TestE2EProfileFaker(unittest.TestCase):
     """E2E tests for `iam_profile_faker` package."""
@@ -90,3 +862,18 @@ class TestE2EProfileFaker(unittest.TestCase):
                 validate(obj, self.schema)
             except:
                 self.fail('Validation failed!')
+
+    def test_002_validate_factory_create_batch_bulk(self):
+        """Validate multiple fake objects created by the bulk engine"""
+
+        if not self.schema:
+            self.skipTest('Failed to fetch json schema.')
+
+        factory = V2ProfileFactory()
+        output = factory.create_batch(10, engine='bulk')
+
+        for obj in output:
+            try:
+                validate(obj, self.schema)
+            except:
+                self.fail('Validation failed!')